@@ -0,0 +1,116 @@
+"""
+Request-scoped batching of id lookups.
+
+Every load(collection, id) made during the same event-loop tick is answered
+by one `$in` query per collection (and key/projection). Repeated ids are
+fetched once and cached for the rest of the request, so loops can look up
+documents one by one, concurrently, without a round trip per document:
+
+    loader = get_loader()
+    teams = await asyncio.gather(*(loader.load("teams", p["team_id"]) for p in projects))
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Optional
+from app.config.database import db
+from app.core.mongodb_utils import safe_objectid
+
+
+class DataLoader:
+    def __init__(self, database=None):
+        self.db = database if database is not None else db
+        self._cache: dict[tuple, asyncio.Future] = {}
+        self._pending: dict[tuple, dict[str, tuple[Any, asyncio.Future]]] = {}
+        self._fetches: set[asyncio.Task] = set()
+
+    def load(self, collection: str, id: Any, key: str = "_id", projection: Optional[dict] = None) -> asyncio.Future:
+        """
+        Future resolving to the document whose `key` equals id, or None.
+        For key "_id", string and ObjectId ids are interchangeable.
+        """
+        loop = asyncio.get_running_loop()
+        if id is None:
+            done = loop.create_future()
+            done.set_result(None)
+            return done
+        if key == "_id":
+            value = safe_objectid(id)
+            if value is None:
+                done = loop.create_future()
+                done.set_result(None)
+                return done
+        else:
+            value = id
+        batch_key = (collection, key, tuple(sorted((projection or {}).items())))
+        cache_key = batch_key + (str(value),)
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+
+        future = loop.create_future()
+        self._cache[cache_key] = future
+        if batch_key not in self._pending:
+            self._pending[batch_key] = {}
+            # Runs after every callback already queued in this tick has had its turn
+            loop.call_soon(self._dispatch, batch_key, projection)
+        self._pending[batch_key][str(value)] = (value, future)
+        return future
+
+    async def load_many(self, collection: str, ids: list, key: str = "_id", projection: Optional[dict] = None) -> list:
+        return list(await asyncio.gather(*(self.load(collection, i, key, projection) for i in ids)))
+
+    def clear(self, collection: Optional[str] = None):
+        """Forget cached documents (of one collection) after writing to them."""
+        for cache_key in [k for k in self._cache if collection is None or k[0] == collection]:
+            del self._cache[cache_key]
+
+    def _dispatch(self, batch_key: tuple, projection: Optional[dict]):
+        batch = self._pending.pop(batch_key)
+        task = asyncio.get_running_loop().create_task(self._fetch(batch_key, projection, batch))
+        self._fetches.add(task)
+        task.add_done_callback(self._fetches.discard)
+
+    async def _fetch(self, batch_key: tuple, projection: Optional[dict], batch: dict):
+        collection, key, _ = batch_key
+        if projection and key != "_id":
+            projection = {**projection, key: 1}  # needed to match documents back to ids
+        try:
+            found = {}
+            values = [value for value, _ in batch.values()]
+            async for doc in self.db[collection].find({key: {"$in": values}}, projection):
+                found.setdefault(str(doc.get(key)), doc)
+        except Exception as e:
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for value_str, (_, future) in batch.items():
+            if not future.done():
+                future.set_result(found.get(value_str))
+
+
+_current: ContextVar[Optional[DataLoader]] = ContextVar("dataloader", default=None)
+
+
+def get_loader() -> DataLoader:
+    """The current request's loader (a fresh one outside of a request)."""
+    loader = _current.get()
+    if loader is None:
+        loader = DataLoader()
+        _current.set(loader)
+    return loader
+
+
+class DataLoaderMiddleware:
+    """Give every HTTP request its own DataLoader, visible to all tasks it spawns."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _current.set(DataLoader())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
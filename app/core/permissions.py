@@ -1,4 +1,9 @@
+import os
+import time
+from contextvars import ContextVar
 from fastapi import HTTPException
+from app.config.database import db
+from app.core.mongodb_utils import safe_objectid
 
 def check_role(user, allowed_roles):
     if user.get("role") not in allowed_roles:
@@ -19,3 +24,85 @@ def is_panel(user):
     if user.get("role") != "panel":
         raise HTTPException(status_code=403, detail="Panel access only")
     return True
+
+
+# --------------------------------------------------------
+# Team / project membership resolver
+# --------------------------------------------------------
+# A user's memberships are loaded with one aggregation (teams listing the user
+# in members or member_ids, stored as strings or ObjectIds, joined with the
+# projects pointing at those teams). Results are cached for the current
+# request and for MEMBERSHIP_CACHE_SECONDS across requests; any team write
+# must call invalidate_memberships().
+MEMBERSHIP_CACHE_SECONDS = int(os.getenv("MEMBERSHIP_CACHE_SECONDS", "30"))
+
+
+class Membership:
+    def __init__(self, user_id: str, team_ids: set[str], project_ids: set[str]):
+        self.user_id = user_id
+        self.team_ids = team_ids
+        self.project_ids = project_ids
+
+    def in_team(self, team_id) -> bool:
+        return team_id is not None and str(team_id) in self.team_ids
+
+    def in_project(self, project_id) -> bool:
+        return project_id is not None and str(project_id) in self.project_ids
+
+
+_request_memberships: ContextVar[dict | None] = ContextVar("request_memberships", default=None)
+_shared: dict[str, tuple[float, Membership]] = {}
+_generation = 0
+
+
+async def _load_membership(user_id: str) -> Membership:
+    ids = [user_id]
+    oid = safe_objectid(user_id)
+    if oid:
+        ids.append(oid)
+    pipeline = [
+        {"$match": {"$or": [{"members": {"$in": ids}}, {"member_ids": {"$in": ids}}]}},
+        {"$project": {"project_id": 1, "team_key": {"$toString": "$_id"}}},
+        # projects.team_id holds the team id as a string
+        {"$lookup": {"from": "projects", "localField": "team_key", "foreignField": "team_id", "as": "projects"}},
+        {"$project": {"project_id": 1, "projects._id": 1}},
+    ]
+    team_ids, project_ids = set(), set()
+    async for team in db.teams.aggregate(pipeline):
+        team_ids.add(str(team["_id"]))
+        if team.get("project_id"):
+            project_ids.add(str(team["project_id"]))
+        project_ids.update(str(p["_id"]) for p in team.get("projects", []))
+    return Membership(user_id, team_ids, project_ids)
+
+
+async def get_membership(user_id) -> Membership:
+    """Teams and projects user_id belongs to (cached)."""
+    user_id = str(user_id)
+    per_request = _request_memberships.get()
+    if per_request is None:
+        per_request = {}
+        _request_memberships.set(per_request)
+    if user_id in per_request:
+        return per_request[user_id]
+
+    cached = _shared.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        membership = cached[1]
+    else:
+        generation = _generation
+        membership = await _load_membership(user_id)
+        if generation == _generation:  # don't cache a result that raced an invalidation
+            _shared[user_id] = (time.monotonic() + MEMBERSHIP_CACHE_SECONDS, membership)
+    per_request[user_id] = membership
+    return membership
+
+
+def invalidate_memberships():
+    """Forget cached memberships after teams (or their project links) change."""
+    global _generation
+    _generation += 1
+    _shared.clear()
+    per_request = _request_memberships.get()
+    if per_request:
+        per_request.clear()
@@ -1,4 +1,9 @@
 # app/core/security.py
+import base64
+import hashlib
+import hmac
+import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from fastapi import Depends, HTTPException
@@ -9,6 +14,7 @@ from app.config.database import SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES, users_c
 
 ALGORITHM = "HS256"
 bearer = HTTPBearer(auto_error=True)
+DOWNLOAD_URL_TTL_SECONDS = int(os.getenv("DOWNLOAD_URL_TTL_SECONDS", "900"))
 
 # ---- Token generation ----
 def create_access_token(
@@ -26,6 +32,29 @@ def decode_token(token: str) -> dict:
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
+# ---- Signed download URLs (HMAC over resource id + expiry, no user lookup) ----
+def _download_signature(resource_id: str, expires: int) -> str:
+    mac = hmac.new(SECRET_KEY.encode(), f"download:{resource_id}:{expires}".encode(), hashlib.sha256)
+    return base64.urlsafe_b64encode(mac.digest()).rstrip(b"=").decode()
+
+def sign_download(resource_id: str) -> tuple[int, str]:
+    """
+    Expiry and signature for a download link. Expiries are rounded up to the
+    next TTL boundary, so every link issued for a resource within one window
+    is the same URL and shared caches can reuse the response.
+    """
+    expires = (int(time.time()) // DOWNLOAD_URL_TTL_SECONDS + 2) * DOWNLOAD_URL_TTL_SECONDS
+    return expires, _download_signature(resource_id, expires)
+
+def verify_download(resource_id: str, expires: int | None, sig: str | None) -> int:
+    """Seconds the link stays valid; 403 if it is missing, forged or expired."""
+    if expires is None or not sig or not hmac.compare_digest(sig, _download_signature(resource_id, expires)):
+        raise HTTPException(status_code=403, detail="Invalid download link")
+    remaining = expires - int(time.time())
+    if remaining <= 0:
+        raise HTTPException(status_code=403, detail="Download link expired")
+    return remaining
+
 # ---- Dependency: enforce Authorization: Bearer <token> and return user ----
 async def require_user(credentials: HTTPAuthorizationCredentials = Depends(bearer)):
     if not credentials or credentials.scheme.lower() != "bearer":
@@ -5,8 +5,11 @@ from fastapi.encoders import jsonable_encoder as _original_jsonable_encoder
 from app.routes import auth, users, teams, projects, tasks, feedback, presentations, notifications, files, student_feedback, project_ideas, round_schedules, dashboard, announcements, reports, csv_uploads
 from app.config.database import check_db_connection, users_collection
 from app.services.auth_service import hash_password
+from app.services import allocation_service, title_similarity_service, presentation_service, file_service, upload_session_service, team_service, file_gc_service, feedback_service, notification_service
 from app.core.json_encoder import jsonable_encoder
+from app.core.dataloader import DataLoaderMiddleware
 from datetime import datetime
+import asyncio
 import os
 
 # Override FastAPI's default jsonable_encoder with our custom one
@@ -18,6 +21,9 @@ app = FastAPI(
     redirect_slashes=False  # Disable automatic trailing slash redirects
 )
 
+# Per-request batching of id lookups (app.core.dataloader)
+app.add_middleware(DataLoaderMiddleware)
+
 # CORS settings
 app.add_middleware(
     CORSMiddleware,
@@ -62,6 +68,63 @@ app.include_router(reports.router)
 app.include_router(csv_uploads.router)
 
 
+# -------------------------------------------------------------
+# Create the indexes the services rely on (idempotent)
+# -------------------------------------------------------------
+@app.on_event("startup")
+async def ensure_indexes():
+    try:
+        await allocation_service.ensure_indexes()
+        await title_similarity_service.ensure_indexes()
+        await file_service.ensure_indexes()
+        await upload_session_service.ensure_indexes()
+        await team_service.ensure_indexes()
+        await presentation_service.ensure_indexes()
+        await feedback_service.ensure_indexes()
+        await notification_service.ensure_indexes()
+    except Exception as e:
+        # Startup should not crash if this fails; just log
+        print("ensure_indexes error:", e)
+
+
+# -------------------------------------------------------------
+# Move inline presentation blobs into GridFS in the background
+# (resumable: re-runs pick up whatever is still inline)
+# -------------------------------------------------------------
+@app.on_event("startup")
+async def start_presentation_file_migration():
+    async def run():
+        try:
+            await presentation_service.migrate_inline_files()
+        except Exception as e:
+            print("presentation file migration error:", e)
+    asyncio.create_task(run())
+
+
+# -------------------------------------------------------------
+# Periodically drop abandoned resumable upload sessions
+# -------------------------------------------------------------
+@app.on_event("startup")
+async def start_upload_session_expiry():
+    asyncio.create_task(upload_session_service.run_expiry_loop())
+
+
+# -------------------------------------------------------------
+# Periodically sweep unreferenced GridFS data and file documents
+# -------------------------------------------------------------
+@app.on_event("startup")
+async def start_file_gc():
+    asyncio.create_task(file_gc_service.run_periodically())
+
+
+# -------------------------------------------------------------
+# Periodically repair drift in the per-user unread notification counters
+# -------------------------------------------------------------
+@app.on_event("startup")
+async def start_notification_counter_reconciliation():
+    asyncio.create_task(notification_service.run_reconciliation_loop())
+
+
 # -------------------------------------------------------------
 # Create a default admin user on startup (if none exists)
 # Configure with env vars: ADMIN_EMAIL, ADMIN_PASSWORD, ADMIN_USERNAME
@@ -1,10 +1,11 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class FeedbackCreate(BaseModel):
     team_id: str
     project_id: str
     round_number: int
+    presentation_id: Optional[str] = None
     evaluator_id: str  # mentor or panel id
     score: float
     comments: Optional[str] = None
@@ -14,7 +15,19 @@ class FeedbackOut(BaseModel):
     team_id: str
     project_id: str
     round_number: int
+    presentation_id: Optional[str] = None
     evaluator_id: str
     score: float
     comments: Optional[str]
     created_at: Optional[str]
+
+class EvaluationItem(BaseModel):
+    presentation_id: str
+    technical_implementation: int
+    presentation_clarity: int
+    problem_solving: int
+    overall_impression: int
+    comments: Optional[str] = None
+
+class BulkEvaluationCreate(BaseModel):
+    evaluations: List[EvaluationItem]
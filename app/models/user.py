@@ -11,6 +11,10 @@ class UserCreate(BaseModel):
     email: EmailStr
     password: constr(min_length=6, max_length=72)
     role: str  # "student", "mentor", "panel", "admin"
+class SetPasswordInput(BaseModel):
+    token: str
+    password: constr(min_length=6, max_length=72)
+
 class UserOut(BaseModel):
     id: str
     username: str
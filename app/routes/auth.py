@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException
-from app.models.user import UserCreate, LoginInput, UserOut
-from app.services.auth_service import hash_password, verify_password
-from app.core.security import create_access_token
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from app.models.user import UserCreate, LoginInput, SetPasswordInput, UserOut
+from app.services.auth_service import hash_password, verify_password, invite_token_hash, new_invite
+from app.core.security import create_access_token, require_user
+from app.core.mongodb_utils import safe_objectid
+from app.services import guide_match_service
 from app.config.database import users_collection, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -14,12 +17,14 @@ async def register(user: UserCreate):
     doc = user.dict()
     doc["password"] = hash_password(user.password)
     inserted = await users_collection.insert_one(doc)
+    guide_match_service.invalidate()
     return UserOut(id=str(inserted.inserted_id), username=user.username, email=user.email, role=user.role)
 
 @router.post("/login")
 async def login(user: LoginInput):
     db_user = await users_collection.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    # Accounts created from allocations have no password until their invite is used
+    if not db_user or not db_user.get("password") or not verify_password(user.password, db_user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     # Update last_login timestamp
     try:
@@ -38,3 +43,28 @@ async def login(user: LoginInput):
     }
 
 
+
+
+@router.post("/set-password")
+async def set_password(payload: SetPasswordInput):
+    """Set the password of an invited account with its one-time invite token"""
+    token_hash = invite_token_hash(payload.token)
+    result = await users_collection.update_one(
+        {"invite_token_hash": token_hash, "invite_expires_at": {"$gt": datetime.utcnow()}},
+        {"$set": {"password": hash_password(payload.password)}, "$unset": {"invite_token_hash": "", "invite_expires_at": ""}},
+    )
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail="Invalid or expired invite")
+    return {"success": True}
+
+@router.post("/invite/{user_id}")
+async def issue_invite(user_id: str, user=Depends(require_user)):
+    """Issue a fresh set-password invite for an account (admin only); replaces any earlier one"""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    oid = safe_objectid(user_id)
+    token, fields = new_invite()
+    target = await users_collection.find_one_and_update({"_id": oid}, {"$set": fields}, projection={"email": 1}) if oid else None
+    if not target:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"user_id": user_id, "email": target["email"], "invite_token": token, "expires_at": fields["invite_expires_at"].isoformat()}
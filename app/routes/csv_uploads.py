@@ -1,8 +1,10 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from app.core.security import require_user
 from app.config.database import db
+from app.services import allocation_service, guide_match_service, title_similarity_service
+import asyncio
 import csv
-from io import StringIO
+from io import BytesIO, StringIO
 from datetime import datetime
 from bson import ObjectId
 import pandas as pd
@@ -199,11 +201,36 @@ def _process_form_responses_sheet(df: pd.DataFrame) -> List[Dict[str, Any]]:
 
 
 @router.post("/upload")
-async def upload_allocation_csv(file: UploadFile = File(...), user=Depends(require_user)):
+async def upload_allocation_csv(file: UploadFile = File(...), mode: str = "upsert", user=Depends(require_user)):
+    """
+    Upload an allocation CSV/Excel file.
+
+    mode=upsert (default) applies the rows keyed on enrollment_no + sheet and
+    reports inserted/updated/unchanged counts; mode=append inserts every row
+    as a new batch. Byte-identical re-uploads are skipped in both modes.
+    """
+    if mode not in ("upsert", "append"):
+        raise HTTPException(status_code=400, detail="mode must be 'upsert' or 'append'")
+
     raw = await file.read()
     if not raw:
         raise HTTPException(status_code=400, detail="Empty file uploaded")
 
+    digest = allocation_service.content_hash(raw)
+    previous = await allocation_service.find_upload_by_hash(digest)
+    if previous:
+        return {
+            "skipped": True,
+            "reason": "Identical file already uploaded",
+            "duplicate_of": previous.get("batch_id"),
+            "batch_id": previous.get("batch_id"),
+            "content_hash": digest,
+            "inserted": 0,
+            "updated": 0,
+            "unchanged": (previous.get("summary") or {}).get("rows", 0),
+            "duplicates": 0,
+        }
+
     # Determine file type based on extension and content
     file_extension = file.filename.lower().split('.')[-1] if '.' in file.filename else ""
     batch_id = datetime.utcnow().isoformat()
@@ -299,7 +326,11 @@ async def upload_allocation_csv(file: UploadFile = File(...), user=Depends(requi
     if not docs:
         raise HTTPException(status_code=400, detail="File contains no data rows")
 
-    await db.allocations.insert_many(docs)
+    if mode == "upsert":
+        counts = await allocation_service.upsert_allocations(docs)
+    else:
+        await db.allocations.insert_many(docs)
+        counts = {"inserted": len(docs), "updated": 0, "unchanged": 0, "duplicates": 0}
 
     # Build quick summary for response
     groups = len({d["group_no"] for d in docs if d.get("group_no")})
@@ -307,8 +338,15 @@ async def upload_allocation_csv(file: UploadFile = File(...), user=Depends(requi
     students = len([d for d in docs if d.get("student_name")])
     sheets = len(set(d.get("sheet_name", "CSV") for d in docs)) if file_extension in ['xlsx', 'xls'] else 1
 
+    await allocation_service.record_upload(digest, batch_id, file.filename, user["_id"], {"rows": len(docs), **counts})
+    # Keep the near-duplicate title index current (rows updated by this upload keep their original batch_id)
+    await title_similarity_service.index_allocations({"$or": [{"batch_id": batch_id}, {"last_batch_id": batch_id}]})
+
     return {
-        "inserted": len(docs),
+        "skipped": False,
+        "mode": mode,
+        "content_hash": digest,
+        **counts,
         "batch_id": batch_id,
         "groups": groups,
         "guides": guides,
@@ -318,9 +356,40 @@ async def upload_allocation_csv(file: UploadFile = File(...), user=Depends(requi
     }
 
 
+def _sheet_dimensions(raw: bytes) -> Dict[str, tuple]:
+    """Read (max_row, max_column) per sheet from the workbook metadata only"""
+    wb = openpyxl.load_workbook(BytesIO(raw), read_only=True)
+    try:
+        dims = {}
+        for ws in wb.worksheets:
+            if ws.max_row is None or ws.max_column is None:
+                # Sheet written without a <dimension> element; fall back to a scan
+                try:
+                    ws.calculate_dimension(force=True)
+                except UnboundLocalError:
+                    # openpyxl fails this way when the sheet has no cells at all
+                    dims[ws.title] = (0, 0)
+                    continue
+            dims[ws.title] = (ws.max_row or 0, ws.max_column or 0)
+        return dims
+    finally:
+        wb.close()
+
+
+def _sheet_preview(raw: bytes, sheet_name: str, nrows: int) -> pd.DataFrame:
+    """Read only the first rows of a sheet"""
+    return pd.read_excel(BytesIO(raw), sheet_name=sheet_name, nrows=nrows)
+
+
 @router.get("/excel-info")
-async def get_excel_file_info(file: UploadFile = File(...), user=Depends(require_user)):
-    """Preview Excel file structure before uploading"""
+async def get_excel_file_info(file: UploadFile = File(...), preview_rows: int = 5, user=Depends(require_user)):
+    """
+    Preview Excel file structure before uploading.
+
+    For .xlsx files the sheet shape comes from the workbook's dimension metadata
+    (which may include formatted but empty trailing rows) and only the first
+    preview_rows rows of each sheet are parsed, with sheets read concurrently.
+    """
     if not file.filename.lower().endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
 
@@ -328,22 +397,47 @@ async def get_excel_file_info(file: UploadFile = File(...), user=Depends(require
     if not raw:
         raise HTTPException(status_code=400, detail="Empty file uploaded")
 
+    preview_rows = max(1, min(int(preview_rows), 50))
+
     try:
-        excel_file = pd.ExcelFile(raw)
+        if file.filename.lower().endswith('.xlsx'):
+            dims = await asyncio.to_thread(_sheet_dimensions, raw)
+            sheet_names = list(dims.keys())
+        else:
+            # Legacy .xls has no cheap metadata; sizes come from a full read below
+            dims = {}
+            sheet_names = pd.ExcelFile(BytesIO(raw)).sheet_names
+
         info = {
             "file_name": file.filename,
-            "total_sheets": len(excel_file.sheet_names),
-            "sheet_names": excel_file.sheet_names,
+            "total_sheets": len(sheet_names),
+            "sheet_names": sheet_names,
             "sheets": []
         }
 
-        for sheet_name in excel_file.sheet_names:
-            df = pd.read_excel(excel_file, sheet_name=sheet_name)
+        # Row 0 of each preview doubles as the headers, so read at least one row
+        previews = await asyncio.gather(*[
+            asyncio.to_thread(_sheet_preview, raw, name, None if name not in dims else max(preview_rows, 1))
+            for name in sheet_names
+        ])
+
+        for sheet_name, df in zip(sheet_names, previews):
+            if sheet_name in dims:
+                max_row, max_col = dims[sheet_name]
+                rows = max(max_row - 1, 0)  # excluding the header row, as pandas counts it
+                cols = max(max_col, len(df.columns))
+            else:
+                rows, cols = len(df), len(df.columns)
             sheet_info = {
                 "name": sheet_name,
-                "shape": [len(df), len(df.columns)],
+                "shape": [rows, cols],
                 "headers": [str(cell) if pd.notna(cell) else "" for cell in df.iloc[0]] if len(df) > 0 else [],
-                "data_rows": len(df) - 1 if len(df) > 1 else 0
+                "data_rows": rows - 1 if rows > 1 else 0,
+                "shape_source": "metadata" if sheet_name in dims else "full_read",
+                "preview": [
+                    [str(cell) if pd.notna(cell) else "" for cell in row]
+                    for row in df.head(preview_rows).itertuples(index=False)
+                ],
             }
             info["sheets"].append(sheet_info)
 
@@ -398,10 +492,28 @@ async def delete_allocation_batch(batch_id: str, user=Depends(require_user)):
             batch_records.append(record)
 
         if not batch_records:
-            raise HTTPException(status_code=404, detail="Batch not found")
+            # An upload that only updated existing rows owns none of them;
+            # deleting it just releases its file hash
+            upload = await db.allocation_uploads.find_one({"batch_id": batch_id})
+            if not upload:
+                raise HTTPException(status_code=404, detail="Batch not found")
+            await allocation_service.forget_batch_uploads(batch_id)
+            return {
+                "deleted": 0,
+                "batch_id": batch_id,
+                "groups": 0,
+                "guides": 0,
+                "students": 0,
+                "sheets": 0,
+                "message": "Upload owned no records; it can now be uploaded again"
+            }
 
         # Delete all records from this batch
         result = await db.allocations.delete_many({"batch_id": batch_id})
+        # Allow the same file, and any later upload that only touched these rows, to be uploaded again
+        await allocation_service.forget_batch_uploads(batch_id)
+        await allocation_service.forget_orphaned_uploads()
+        await title_similarity_service.remove_batch(batch_id)
 
         # Count by categories for response
         groups = len({r.get("group_no") for r in batch_records if r.get("group_no")})
@@ -454,6 +566,24 @@ async def list_batches(user=Depends(require_user)):
                 batches[batch_id]["students"] += 1
             batches[batch_id]["sheets"].add(record.get("sheet_name", "CSV"))
 
+        # Uploads whose rows all already existed own no records but are still listed
+        for upload in await allocation_service.list_uploads():
+            batch_id = upload.get("batch_id")
+            if batch_id in batches:
+                continue
+            filename = upload.get("filename") or ""
+            batches[batch_id] = {
+                "batch_id": batch_id,
+                "uploaded_at": upload.get("uploaded_at", ""),
+                "uploaded_by": upload.get("uploaded_by", ""),
+                "file_type": "Excel" if filename.lower().endswith((".xlsx", ".xls")) else "CSV",
+                "records": 0,
+                "groups": set(),
+                "guides": set(),
+                "students": 0,
+                "sheets": set()
+            }
+
         # Convert sets to counts and sort by upload date
         batch_list = []
         for batch in batches.values():
@@ -470,21 +600,29 @@ async def list_batches(user=Depends(require_user)):
 
 
 @router.get("/records")
-async def list_records(limit: int = 100, user=Depends(require_user)):
+async def list_records(
+    limit: int = 100,
+    cursor: str | None = None,
+    batch_id: str | None = None,
+    sheet_name: str | None = None,
+    guide_name: str | None = None,
+    group_no: str | None = None,
+    fields: str | None = None,
+    user=Depends(require_user),
+):
+    """
+    Page through allocation records, newest first.
+
+    Pass the returned next_cursor back as cursor to get the following page;
+    it is null on the last page. fields is an optional comma-separated list
+    of fields to return.
+    """
+    filters = {"batch_id": batch_id, "sheet_name": sheet_name, "guide_name": guide_name, "group_no": group_no}
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
     try:
-        items = []
-        cursor = db.allocations.find({}).sort("uploaded_at", -1).limit(int(limit))
-        async for d in cursor:
-            d["id"] = str(d.get("_id"))
-            d.pop("_id", None)
-            # Serialize any ObjectId fields to strings for JSON
-            if isinstance(d.get("uploaded_by"), ObjectId):
-                d["uploaded_by"] = str(d["uploaded_by"])
-            items.append(d)
-        return items
-    except Exception:
-        # Return an empty list rather than raising 500, to keep UI functional
-        return []
+        return await allocation_service.list_allocations(filters, cursor, limit, field_list)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @router.patch("/{record_id}")
@@ -502,10 +640,14 @@ async def update_record(record_id: str, payload: dict, user=Depends(require_user
     if not update_doc:
         raise HTTPException(status_code=400, detail="No valid fields to update")
 
+    previous = await db.allocations.find_one({"_id": ObjectId(record_id)}, {"batch_id": 1, "sheet_name": 1, "group_no": 1})
     result = await db.allocations.update_one({"_id": ObjectId(record_id)}, {"$set": update_doc})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Record not found")
 
+    if "title_1" in update_doc or "group_no" in update_doc:
+        await title_similarity_service.reindex_record(ObjectId(record_id), previous)
+
     doc = await db.allocations.find_one({"_id": ObjectId(record_id)})
     doc_out = dict(doc)
     doc_out["id"] = str(doc_out.pop("_id"))
@@ -514,6 +656,40 @@ async def update_record(record_id: str, payload: dict, user=Depends(require_user
     return doc_out
 
 
+@router.get("/guide-matches")
+async def match_guide_names(batch_id: str | None = None, user=Depends(require_user)):
+    """Resolve every distinct guide_name in a batch (or all batches) to mentor/panel accounts with confidence scores"""
+    return await guide_match_service.match_batch(batch_id)
+
+
+@router.get("/title-duplicates")
+async def find_duplicate_titles(batch_id: str | None = None, threshold: float = title_similarity_service.DEFAULT_THRESHOLD, user=Depends(require_user)):
+    """Clusters of near-duplicate proposed titles within a batch, or across all batches"""
+    if not 0 < threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be between 0 and 1")
+    return await title_similarity_service.find_near_duplicates(batch_id, threshold)
+
+
+@router.post("/title-index/rebuild")
+async def rebuild_title_index(user=Depends(require_user)):
+    """Recompute title signatures for every allocation row (e.g. for rows uploaded before indexing existed)"""
+    indexed = await title_similarity_service.index_allocations({})
+    return {"indexed": indexed}
+
+
+@router.post("/materialize")
+async def materialize_allocations(batch_id: str | None = None, dry_run: bool = True, user=Depends(require_user)):
+    """
+    Turn allocation rows into student users, teams (with members/mentor_id)
+    and projects (from title_1). Limit to one upload with batch_id; with
+    dry_run (the default) only the planned creates/updates are returned.
+    Admin only; the response carries the invite tokens of new accounts.
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await allocation_service.materialize_allocations(batch_id, str(user["_id"]), dry_run)
+
+
 # ------- Create a new allocation group with up to 4 students -------
 @router.post("/groups")
 async def create_group(payload: dict, user=Depends(require_user)):
@@ -563,6 +739,7 @@ async def create_group(payload: dict, user=Depends(require_user)):
 
     result = await db.allocations.insert_many(docs)
     created_ids = [str(i) for i in result.inserted_ids]
+    await title_similarity_service.index_allocations({"batch_id": batch_id})
     return {
         "created": len(created_ids),
         "ids": created_ids,
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
-from app.models.feedback import FeedbackCreate, FeedbackOut
+from app.models.feedback import BulkEvaluationCreate, FeedbackCreate, FeedbackOut
 from app.core.security import require_user
+from app.core.dataloader import get_loader
 from app.services import feedback_service
 from app.services import presentation_service
 
@@ -15,6 +16,36 @@ async def submit_feedback(feedback: FeedbackCreate, user=Depends(require_user)):
     saved = await feedback_service.get_feedback_by_id(inserted_id)
     return saved
 
+@router.get("/stats/presentation/{presentation_id}")
+async def presentation_score_stats(presentation_id: str, user=Depends(require_user)):
+    stats = await feedback_service.presentation_stats(presentation_id)
+    if not stats:
+        raise HTTPException(status_code=404, detail="Presentation not found")
+    return stats
+
+@router.get("/stats/team/{team_id}")
+async def team_score_stats(team_id: str, user=Depends(require_user)):
+    return await feedback_service.team_stats(team_id)
+
+@router.get("/stats/round/{round_number}")
+async def round_score_stats(round_number: int, user=Depends(require_user)):
+    return await feedback_service.round_stats(round_number)
+
+@router.get("/leaderboard/{round_number}")
+async def round_leaderboard(round_number: int, limit: int = 50, user=Depends(require_user)):
+    entries = await feedback_service.get_leaderboard(round_number, max(1, min(limit, 500)))
+    teams = await get_loader().load_many("teams", [e["team_id"] for e in entries], projection={"name": 1})
+    for entry, team in zip(entries, teams):
+        entry["team_name"] = team.get("name") if team else None
+    return entries
+
+@router.post("/leaderboard/{round_number}/rebuild")
+async def rebuild_round_leaderboard(round_number: int, user=Depends(require_user)):
+    """Recompute a round's leaderboard from all stored feedback (admin only)"""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"round_number": round_number, "teams": await feedback_service.rebuild_leaderboard(round_number)}
+
 @router.get("/{team_id}", response_model=list[FeedbackOut])
 async def view_feedback(team_id: str, user=Depends(require_user)):
     return await feedback_service.get_feedback_by_team(team_id)
@@ -33,15 +64,22 @@ async def evaluate_presentation(
     pres = await presentation_service.get_presentation_by_id(presentation_id)
     if not pres:
         raise HTTPException(status_code=404, detail="Presentation not found")
-    score = technical_implementation + presentation_clarity + problem_solving + overall_impression
-    doc = {
-        "team_id": pres.get("team_id"),
-        "project_id": pres.get("project_id"),
-        "round_number": pres.get("round_number"),
-        "evaluator_id": str(user["_id"]),
-        "score": score,
-        "comments": comments,
+    scores = {
+        "technical_implementation": technical_implementation,
+        "presentation_clarity": presentation_clarity,
+        "problem_solving": problem_solving,
+        "overall_impression": overall_impression,
     }
+    doc = feedback_service.evaluation_doc(pres, presentation_id, str(user["_id"]), scores, comments)
     inserted_id = await feedback_service.submit_feedback(doc)
     saved = await feedback_service.get_feedback_by_id(inserted_id)
     return saved
+
+
+@router.post("/evaluate/bulk")
+async def evaluate_presentations_bulk(payload: BulkEvaluationCreate, user=Depends(require_user)):
+    """Submit many rubric evaluations at once; each item gets its own status"""
+    if len(payload.evaluations) > feedback_service.MAX_BULK_EVALUATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {feedback_service.MAX_BULK_EVALUATIONS} evaluations per request")
+    results = await feedback_service.submit_evaluations([e.dict() for e in payload.evaluations], str(user["_id"]))
+    return {"created": sum(1 for r in results if r["status"] == "created"), "results": results}
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form, Request
 from app.core.security import require_user
-from app.services import file_service
+from pymongo.errors import DuplicateKeyError
+from app.services import file_service, file_cache_service, upload_session_service, file_gc_service
 
 router = APIRouter(prefix="/files", tags=["Files"])
 
@@ -15,11 +15,70 @@ async def upload_file(
     saved_file = await file_service.save_file(file, user["_id"], project_id)
     return saved_file
 
+# Resumable uploads: create a session, PUT numbered chunks (any order), then complete
+@router.post("/uploads")
+async def create_upload_session(
+    filename: str = Form(...),
+    total_size: int = Form(...),
+    chunk_size: int = Form(None),
+    project_id: str = Form(None),
+    user=Depends(require_user)
+):
+    return await upload_session_service.create_session(
+        "file", str(user["_id"]), filename, total_size, chunk_size, context={"project_id": project_id}
+    )
+
+@router.put("/uploads/{session_id}/chunks/{index}")
+async def upload_chunk(session_id: str, index: int, request: Request, user=Depends(require_user)):
+    data = await upload_session_service.read_chunk(request)
+    return await upload_session_service.put_chunk(session_id, "file", str(user["_id"]), index, data)
+
+@router.get("/uploads/{session_id}")
+async def get_upload_session(session_id: str, user=Depends(require_user)):
+    """Which chunks have been received so far"""
+    return await upload_session_service.get_session(session_id, "file", str(user["_id"]))
+
+@router.post("/uploads/{session_id}/complete")
+async def complete_upload_session(session_id: str, user=Depends(require_user)):
+    async def attach(session, blob):
+        try:
+            return await file_service.insert_file_doc(
+                session["ref_id"], session["filename"], session["owner_id"], session["context"].get("project_id"), blob
+            )
+        except DuplicateKeyError:
+            # Created by an earlier attempt that failed afterwards
+            return await file_service.get_file_by_id(str(session["ref_id"]))
+
+    return await upload_session_service.finalize(session_id, "file", str(user["_id"]), attach)
+
+@router.delete("/uploads/{session_id}")
+async def abort_upload_session(session_id: str, user=Depends(require_user)):
+    return await upload_session_service.abort(session_id, "file", str(user["_id"]))
+
 @router.get("/project/{project_id}")
-async def get_files_by_project(project_id: str, user=Depends(require_user)):
-    """Get all files for a specific project"""
-    files = await file_service.get_files_by_project(project_id)
-    return files
+async def get_files_by_project(project_id: str, limit: int = 50, cursor: str | None = None, user=Depends(require_user)):
+    """
+    Page through a project's files, newest first. Pass the returned
+    next_cursor back as cursor to get the following page; it is null on the
+    last page.
+    """
+    try:
+        return await file_service.get_files_by_project(project_id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/projects")
+async def get_files_by_projects(ids: str, per_project: int = 20, user=Depends(require_user)):
+    """Latest files of several projects (comma-separated ids) keyed by project id"""
+    project_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    return await file_service.get_files_by_projects(project_ids, per_project)
+
+@router.post("/gc")
+async def collect_garbage(dry_run: bool = True, user=Depends(require_user)):
+    """Sweep unreferenced file data now (admin only); dry_run just reports what would be removed"""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await file_gc_service.collect(dry_run)
 
 @router.put("/{file_id}")
 async def update_file(
@@ -43,7 +102,7 @@ async def delete_file(file_id: str, user=Depends(require_user)):
 
 
 @router.get("/{file_id}")
-async def download_file(file_id: str, user=Depends(require_user)):
+async def download_file(file_id: str, request: Request, user=Depends(require_user)):
     # Fetch file metadata
     file_data = await file_service.get_file_by_id(file_id)
     if not file_data:
@@ -54,14 +113,8 @@ async def download_file(file_id: str, user=Depends(require_user)):
     if not gridfs_id:
         raise HTTPException(status_code=400, detail="Invalid file metadata")
 
-    # Stream file
-    file_stream = await file_service.get_file_stream(gridfs_id)
-    if not file_stream:
+    # Serve from the disk cache or stream from GridFS, with Range / conditional GET support
+    response = await file_cache_service.download_response(request, gridfs_id, file_data["filename"])
+    if response is None:
         raise HTTPException(status_code=404, detail="File content not found")
-
-    # Return streaming response
-    return StreamingResponse(
-        file_stream,
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename={file_data['filename']}"}
-    )
+    return response
@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
-from app.core.security import require_user
-from app.core.mongodb_utils import safe_objectid, safe_objectid_list
-from app.services import presentation_service
+import asyncio
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request
+from app.core.security import require_user, sign_download, verify_download
+from app.core.permissions import get_membership
+from app.core.dataloader import get_loader
+from app.core.mongodb_utils import safe_objectid
+from app.services import panel_schedule_service, presentation_service, upload_session_service
 from app.schemas.presentation import PresentationOut
 from app.config.database import db
-from bson import ObjectId
-from fastapi.responses import StreamingResponse
 from datetime import datetime
 
 router = APIRouter(prefix="/presentations", tags=["Presentations"])
@@ -20,20 +21,23 @@ async def upload_presentation(
     assigned_panel_ids: str = Form(''),
     user=Depends(require_user)
 ):
+    # Save the file to DB
+    file_id = await presentation_service.save_ppt_file(file, user["_id"])
+    return await _attach_presentation_file(file_id, team_id, project_id, round_number, date, assigned_panel_ids, user)
+
+
+async def _attach_presentation_file(file_id: str, team_id: str, project_id: str, round_number: int, date: str, assigned_panel_ids: str, user):
     # Check if presentation already exists for this project and round
     existing = await db.presentations.find_one({
         "project_id": project_id,
         "round_number": round_number
     })
     
-    # Save the file to DB
-    file_id = await presentation_service.save_ppt_file(file, user["_id"])
-
     if existing:
         # Update existing presentation - delete old files first
-        old_file_ids = existing.get("file_ids", [])
+        old_file_ids = [fid for fid in existing.get("file_ids", []) if fid != file_id]
         if old_file_ids:
-            await db.files.delete_many({"_id": {"$in": [ObjectId(fid) for fid in old_file_ids]}})
+            await presentation_service.delete_files(old_file_ids)
         
         # Update presentation with new file
         await db.presentations.update_one(
@@ -62,6 +66,56 @@ async def upload_presentation(
     
     return saved
 
+
+# Resumable uploads: create a session, PUT numbered chunks (any order), then complete
+@router.post("/uploads")
+async def create_upload_session(
+    filename: str = Form(...),
+    total_size: int = Form(...),
+    team_id: str = Form(...),
+    project_id: str = Form(...),
+    round_number: int = Form(...),
+    date: str = Form(...),
+    assigned_panel_ids: str = Form(''),
+    chunk_size: int = Form(None),
+    content_type: str = Form(None),
+    user=Depends(require_user)
+):
+    return await upload_session_service.create_session("presentation", str(user["_id"]), filename, total_size, chunk_size, content_type, {
+        "team_id": team_id,
+        "project_id": project_id,
+        "round_number": round_number,
+        "date": date,
+        "assigned_panel_ids": assigned_panel_ids,
+    })
+
+@router.put("/uploads/{session_id}/chunks/{index}")
+async def upload_chunk(session_id: str, index: int, request: Request, user=Depends(require_user)):
+    data = await upload_session_service.read_chunk(request)
+    return await upload_session_service.put_chunk(session_id, "presentation", str(user["_id"]), index, data)
+
+@router.get("/uploads/{session_id}")
+async def get_upload_session(session_id: str, user=Depends(require_user)):
+    """Which chunks have been received so far"""
+    return await upload_session_service.get_session(session_id, "presentation", str(user["_id"]))
+
+@router.post("/uploads/{session_id}/complete")
+async def complete_upload_session(session_id: str, user=Depends(require_user)):
+    async def attach(session, blob):
+        file_id = str(session["ref_id"])
+        if not await db.files.find_one({"_id": session["ref_id"]}, {"_id": 1}):
+            await presentation_service.insert_file_doc(session["ref_id"], session["filename"], session.get("content_type"), user["_id"], blob)
+        ctx = session["context"]
+        return await _attach_presentation_file(
+            file_id, ctx["team_id"], ctx["project_id"], ctx["round_number"], ctx["date"], ctx["assigned_panel_ids"], user
+        )
+
+    return await upload_session_service.finalize(session_id, "presentation", str(user["_id"]), attach)
+
+@router.delete("/uploads/{session_id}")
+async def abort_upload_session(session_id: str, user=Depends(require_user)):
+    return await upload_session_service.abort(session_id, "presentation", str(user["_id"]))
+
 @router.get("/assigned", response_model=list[PresentationOut])
 async def get_assigned_presentations(user=Depends(require_user)):
     panel_id = str(user["_id"])
@@ -74,6 +128,11 @@ async def get_assigned_presentations(user=Depends(require_user)):
     results.sort(key=lambda p: (p.get("round_number", 1), p.get("date", "")))
     return results
 
+@router.get("/assigned/bundle")
+async def download_assigned_bundle(round_number: int | None = None, project_id: str | None = None, user=Depends(require_user)):
+    """Download all files of the caller's assigned presentations as one ZIP"""
+    return await presentation_service.assigned_files_bundle(str(user["_id"]), round_number, project_id)
+
 @router.get("/all")
 async def list_all_presentations(user=Depends(require_user)):
     # Admin-wide list of presentations with light fields
@@ -86,70 +145,90 @@ async def list_all_presentations(user=Depends(require_user)):
     return results
 
 
+@router.post("/prefetch")
+async def prefetch_round_files(round_number: int, user=Depends(require_user)):
+    """Warm the file download cache for all presentations of an upcoming round"""
+    scheduled = await presentation_service.prefetch_round_files(round_number)
+    return {"round_number": round_number, "scheduled": scheduled}
+
+
+@router.post("/schedule-panels")
+async def schedule_panels(
+    round_number: int,
+    panel_size: int = panel_schedule_service.PANEL_SIZE,
+    max_per_day: int = panel_schedule_service.PANEL_DAILY_CAPACITY,
+    reassign: bool = False,
+    dry_run: bool = False,
+    user=Depends(require_user),
+):
+    """Assign panel members to all presentations of a round (admin only)"""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if panel_size < 1 or max_per_day < 1:
+        raise HTTPException(status_code=400, detail="panel_size and max_per_day must be positive")
+    return await panel_schedule_service.schedule_round(round_number, panel_size, max_per_day, reassign, dry_run)
+
+
 @router.get("/file/{file_id}")
-async def download_presentation_file(file_id: str, user=Depends(require_user)):
-    file_objectid = safe_objectid(file_id)
-    if not file_objectid:
+async def download_presentation_file(file_id: str, request: Request, user=Depends(require_user)):
+    return await presentation_service.file_download_response(request, file_id)
+
+
+def _signed_download_path(file_id: str) -> str:
+    expires, sig = sign_download(file_id)
+    return f"/presentations/public/file/{file_id}?expires={expires}&sig={sig}"
+
+
+@router.get("/file/{file_id}/signed-url")
+async def get_signed_download_url(file_id: str, user=Depends(require_user)):
+    """Short-lived link to a presentation file that works without a bearer token"""
+    if not safe_objectid(file_id):
         raise HTTPException(status_code=400, detail="Invalid file ID")
-    doc = await db.files.find_one({"_id": file_objectid})
-    if not doc:
-        raise HTTPException(status_code=404, detail="File not found")
-    data: bytes = doc.get("data")
-    if not data:
-        raise HTTPException(status_code=404, detail="File data missing")
-    filename = doc.get("filename", "file")
-    content_type = doc.get("content_type", "application/octet-stream")
-    return StreamingResponse(iter([data]), media_type=content_type, headers={
-        "Content-Disposition": f"attachment; filename={filename}"
-    })
+    return {"url": _signed_download_path(file_id)}
 
 
 @router.get("/public/file/{file_id}")
-async def download_presentation_file_public(file_id: str):
-    file_objectid = safe_objectid(file_id)
-    if not file_objectid:
-        raise HTTPException(status_code=400, detail="Invalid file ID")
-    doc = await db.files.find_one({"_id": file_objectid})
-    if not doc:
-        raise HTTPException(status_code=404, detail="File not found")
-    data: bytes = doc.get("data")
-    if not data:
-        raise HTTPException(status_code=404, detail="File data missing")
-    filename = doc.get("filename", "file")
-    content_type = doc.get("content_type", "application/octet-stream")
-    return StreamingResponse(iter([data]), media_type=content_type, headers={
-        "Content-Disposition": f"attachment; filename={filename}"
-    })
+async def download_presentation_file_public(file_id: str, request: Request, expires: int | None = None, sig: str | None = None):
+    # The signature is the only check, so no database lookup is made for the caller.
+    # File bytes never change and the URL stops working at `expires`, so shared
+    # caches may keep the response until then.
+    remaining = verify_download(file_id, expires, sig)
+    headers = {"Cache-Control": f"public, max-age={remaining}, immutable"}
+    return await presentation_service.file_download_response(request, file_id, headers)
+
+
+FILE_LIST_PROJECTION = {"filename": 1, "uploaded_at": 1, "content_type": 1}
+
+
+def _file_out(f: dict) -> dict:
+    return {
+        "id": str(f["_id"]),
+        "filename": f.get("filename"),
+        "uploaded_at": f.get("uploaded_at"),
+        "content_type": f.get("content_type"),
+        "download_url": _signed_download_path(str(f["_id"])),
+    }
 
 
 @router.get("/assigned_with_files")
 async def get_assigned_presentations_with_files(user=Depends(require_user)):
     panel_id = str(user["_id"])
-    cursor = db.presentations.find({"assigned_panel_ids": panel_id})
+    presentations = [p async for p in db.presentations.find({"assigned_panel_ids": panel_id})]
+    loader = get_loader()
+    # All presentations' file lookups go out as one batched query
+    file_lists = await asyncio.gather(*(
+        loader.load_many("files", pres.get("file_ids", []), projection=FILE_LIST_PROJECTION) for pres in presentations
+    ))
     results = []
-    async for pres in cursor:
-        pres_id = str(pres["_id"])
-        file_ids = pres.get("file_ids", [])
-        files = []
-        if file_ids:
-            valid_file_ids = safe_objectid_list(file_ids)
-            if valid_file_ids:
-                fcur = db.files.find({"_id": {"$in": valid_file_ids}})
-                async for f in fcur:
-                    files.append({
-                        "id": str(f["_id"]),
-                        "filename": f.get("filename"),
-                        "uploaded_at": f.get("uploaded_at"),
-                        "content_type": f.get("content_type")
-                    })
+    for pres, file_docs in zip(presentations, file_lists):
         results.append({
-            "id": pres_id,
+            "id": str(pres["_id"]),
             "team_id": pres.get("team_id"),
             "project_id": pres.get("project_id"),
             "round_number": pres.get("round_number"),
             "date": pres.get("date"),
             "status": pres.get("status"),
-            "file_list": files,
+            "file_list": [_file_out(f) for f in file_docs if f],
         })
     results.sort(key=lambda p: (p.get("round_number", 1), p.get("date", "")))
     return results
@@ -158,43 +237,35 @@ async def get_assigned_presentations_with_files(user=Depends(require_user)):
 @router.get("/assigned_full")
 async def get_assigned_presentations_full(user=Depends(require_user)):
     panel_id = str(user["_id"])
-    cursor = db.presentations.find({"assigned_panel_ids": panel_id})
+    presentations = [p async for p in db.presentations.find({"assigned_panel_ids": panel_id})]
+
+    # One $in query per collection for everything the presentations reference
+    loader = get_loader()
+    projects, teams, files = await asyncio.gather(
+        loader.load_many("projects", [p.get("project_id") for p in presentations], projection={"title": 1}),
+        loader.load_many("teams", [p.get("team_id") for p in presentations], projection={"name": 1, "member_ids": 1}),
+        loader.load_many("files", [fid for p in presentations for fid in p.get("file_ids", [])], projection=FILE_LIST_PROJECTION),
+    )
+    projects = {str(d["_id"]): d for d in projects if d}
+    teams = {str(d["_id"]): d for d in teams if d}
+    files = {str(d["_id"]): d for d in files if d}
+    users = await loader.load_many("users", [m for t in teams.values() for m in t.get("member_ids", [])], projection={"username": 1, "email": 1})
+    users = {str(d["_id"]): d for d in users if d}
+
     results = []
-    async for pres in cursor:
-        pres_id = str(pres["_id"])
+    for pres in presentations:
         project_id = pres.get("project_id")
         team_id = pres.get("team_id")
-        # Load project and team details
-        project_objectid = safe_objectid(project_id) if project_id else None
-        team_objectid = safe_objectid(team_id) if team_id else None
-        project = await db.projects.find_one({"_id": project_objectid}) if project_objectid else None
-        team = await db.teams.find_one({"_id": team_objectid}) if team_objectid else None
+        project = projects.get(str(project_id)) if project_id else None
+        team = teams.get(str(team_id)) if team_id else None
         members = []
-        if team and team.get("member_ids"):
-            member_ids = safe_objectid_list(team["member_ids"])
-            if member_ids:
-                ucur = db.users.find({"_id": {"$in": member_ids}})
-            else:
-                ucur = []
-            async for u in ucur:
+        for m in (team or {}).get("member_ids", []):
+            u = users.get(str(m))
+            if u:
                 members.append({"id": str(u["_id"]), "name": u.get("username") or u.get("email")})
-        file_ids = pres.get("file_ids", [])
-        files = []
-        if file_ids:
-            valid_file_ids = safe_objectid_list(file_ids)
-            if valid_file_ids:
-                fcur = db.files.find({"_id": {"$in": valid_file_ids}})
-            else:
-                fcur = []
-            async for f in fcur:
-                files.append({
-                    "id": str(f["_id"]),
-                    "filename": f.get("filename"),
-                    "uploaded_at": f.get("uploaded_at"),
-                    "content_type": f.get("content_type")
-                })
+        file_list = [_file_out(files[str(fid)]) for fid in pres.get("file_ids", []) if str(fid) in files]
         results.append({
-            "id": pres_id,
+            "id": str(pres["_id"]),
             "team_id": team_id,
             "project_id": project_id,
             "round_number": pres.get("round_number"),
@@ -203,7 +274,7 @@ async def get_assigned_presentations_full(user=Depends(require_user)):
             "project_title": project.get("title") if project else None,
             "team_name": team.get("name") if team else None,
             "team_members": members,
-            "file_list": files,
+            "file_list": file_list,
         })
     results.sort(key=lambda p: (p.get("round_number", 1), p.get("date", "")))
     return results
@@ -238,19 +309,8 @@ async def update_presentation_file(
     
     # Check if user is a member of the team that owns this presentation
     if not is_authorized:
-        team_id = presentation.get("team_id")
-        if team_id:
-            team_objectid = safe_objectid(team_id)
-            if team_objectid:
-                team = await db.teams.find_one({"_id": team_objectid})
-                if team:
-                    # Check if user is a member of the team
-                    members = team.get("members", [])
-                    member_ids = team.get("member_ids", [])
-                    # Handle both string and ObjectId formats
-                    all_member_ids = [str(m) for m in members] + [str(m) for m in member_ids]
-                    if user_id in all_member_ids:
-                        is_authorized = True
+        membership = await get_membership(user_id)
+        is_authorized = membership.in_team(presentation.get("team_id"))
     
     if not is_authorized:
         raise HTTPException(status_code=403, detail="Not authorized to update this presentation")
@@ -261,7 +321,7 @@ async def update_presentation_file(
     # Delete old files
     old_file_ids = presentation.get("file_ids", [])
     if old_file_ids:
-        await db.files.delete_many({"_id": {"$in": [ObjectId(fid) for fid in old_file_ids]}})
+        await presentation_service.delete_files(old_file_ids)
     
     # Update presentation with new file
     updated = await presentation_service.update_presentation(presentation_id, {
@@ -292,20 +352,10 @@ async def delete_presentation(presentation_id: str, user=Depends(require_user)):
         return result
     
     # Check if user is a member of the team that owns this presentation
-    team_id = presentation.get("team_id")
-    if team_id:
-        team_objectid = safe_objectid(team_id)
-        if team_objectid:
-            team = await db.teams.find_one({"_id": team_objectid})
-            if team:
-                # Check if user is a member of the team
-                members = team.get("members", [])
-                member_ids = team.get("member_ids", [])
-                # Handle both string and ObjectId formats
-                all_member_ids = [str(m) for m in members] + [str(m) for m in member_ids]
-                if user_id in all_member_ids:
-                    result = await presentation_service.delete_presentation(presentation_id)
-                    return result
+    membership = await get_membership(user_id)
+    if membership.in_team(presentation.get("team_id")):
+        result = await presentation_service.delete_presentation(presentation_id)
+        return result
     
     # If none of the above conditions are met, deny access
     raise HTTPException(status_code=403, detail="Not authorized to delete this presentation")
\ No newline at end of file
@@ -1,6 +1,8 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from app.models.project import ProjectCreate, ProjectOut
 from app.core.security import require_user
+from app.core.dataloader import get_loader
 from app.services import project_service, team_service
 from bson import ObjectId
 from bson.errors import InvalidId
@@ -20,9 +22,8 @@ def is_valid_objectid(id_str: str) -> bool:
 async def get_team_id_for_project(project_id: str) -> str | None:
     """Try to find team_id from team that has this project_id"""
     try:
-        from app.config.database import db
-        # Query teams collection directly to find team with this project_id
-        team = await db.teams.find_one({"project_id": project_id})
+        # Batched with the other lookups of this request
+        team = await get_loader().load("teams", project_id, key="project_id", projection={"_id": 1})
         if team:
             return str(team["_id"])
     except Exception:
@@ -62,12 +63,12 @@ async def create_project(project: ProjectCreate, user=Depends(require_user)):
 @router.get("/", response_model=list[ProjectOut])
 async def list_projects(user=Depends(require_user)):
     projects = await project_service.get_projects_by_user(user["_id"])
-    return [await project_to_out(p) for p in projects]
+    return await asyncio.gather(*(project_to_out(p) for p in projects))
 
 @router.get("/all", response_model=list[ProjectOut])
 async def list_all_projects(user=Depends(require_user)):
     projects = await project_service.get_all_projects()
-    return [await project_to_out(p) for p in projects]
+    return await asyncio.gather(*(project_to_out(p) for p in projects))
 
 @router.get("/{project_id}", response_model=ProjectOut)
 async def get_project(project_id: str, user=Depends(require_user)):
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 from app.core.security import require_user
-from app.core.mongodb_utils import safe_objectid, safe_objectid_list
+from app.core.dataloader import get_loader
 from app.config.database import db
 
 router = APIRouter(prefix="/reports", tags=["Reports"])
@@ -15,7 +15,7 @@ async def reports_summary(user=Depends(require_user)):
 
     # Per-mentor team counts
     mentor_team_counts: dict[str, int] = {}
-    async for t in db.teams.find({}):
+    async for t in db.teams.find({}, {"mentor_id": 1}):
         mentor_id = t.get("mentor_id")
         if not mentor_id:
             continue
@@ -24,14 +24,9 @@ async def reports_summary(user=Depends(require_user)):
         if mentor_id_str:
             mentor_team_counts[mentor_id_str] = mentor_team_counts.get(mentor_id_str, 0) + 1
 
-    mentors = {}
-    if mentor_team_counts:
-        # Safely convert mentor IDs to ObjectIds, filtering out invalid ones
-        valid_mentor_objectids = safe_objectid_list(list(mentor_team_counts.keys()))
-        if valid_mentor_objectids:
-            cursor = db.users.find({"_id": {"$in": valid_mentor_objectids}})
-            async for u in cursor:
-                mentors[str(u["_id"])] = u.get("username", u.get("email", ""))
+    # Resolve mentor names in one batched lookup (invalid ids resolve to None)
+    mentor_docs = await get_loader().load_many("users", list(mentor_team_counts), projection={"username": 1, "email": 1})
+    mentors = {str(u["_id"]): u.get("username", u.get("email", "")) for u in mentor_docs if u}
 
     per_mentor = [
         {"mentor_id": m, "mentor_name": mentors.get(m, m), "teams": c}
@@ -40,7 +35,7 @@ async def reports_summary(user=Depends(require_user)):
 
     # Project status counts
     status_counts = {"pending": 0, "active": 0, "completed": 0}
-    async for p in db.projects.find({}):
+    async for p in db.projects.find({}, {"status": 1}):
         s = (p.get("status", "active") or "").lower()
         if s in status_counts:
             status_counts[s] += 1
@@ -2,7 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from bson import ObjectId
 from app.models.task import TaskCreate, TaskOut
 from app.core.security import require_user
-from app.core.mongodb_utils import safe_objectid
+from app.core.permissions import get_membership
+from app.core.dataloader import get_loader
 from app.services import task_service
 from app.config.database import db  # only for accessing collections in lookups where needed
 
@@ -79,27 +80,17 @@ async def get_task(task_id: str, user=Depends(require_user)):
         has_access = True
     # Task is in user's team
     elif doc.get("team_id"):
-        team_objectid = safe_objectid(doc.get("team_id"))
-        if team_objectid:
-            team = await db.teams.find_one({"_id": team_objectid})
-            if team and user_id in team.get("members", []):
-                has_access = True
+        membership = await get_membership(user_id)
+        has_access = membership.in_team(doc.get("team_id"))
     # Task is in user's project
     elif doc.get("project_id"):
-        project_objectid = safe_objectid(doc.get("project_id"))
-        if project_objectid:
-            project = await db.projects.find_one({"_id": project_objectid})
-            if project:
-                # Check if user is in project's team
-                if project.get("team_id"):
-                    team_objectid = safe_objectid(project.get("team_id"))
-                    if team_objectid:
-                        team = await db.teams.find_one({"_id": team_objectid})
-                        if team and user_id in team.get("members", []):
-                            has_access = True
-                # Or user created the project
-                if project.get("created_by") == user_id:
-                    has_access = True
+        membership = await get_membership(user_id)
+        if membership.in_project(doc.get("project_id")):
+            has_access = True
+        else:
+            # Or user created the project
+            project = await get_loader().load("projects", doc.get("project_id"), projection={"created_by": 1})
+            has_access = bool(project and project.get("created_by") == user_id)
     
     if not has_access:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -129,11 +120,8 @@ async def update_task(task_id: str, task: TaskCreate, user=Depends(require_user)
         can_update = True
     # User is in the task's team
     elif existing.get("team_id"):
-        team_objectid = safe_objectid(existing.get("team_id"))
-        if team_objectid:
-            team = await db.teams.find_one({"_id": team_objectid})
-            if team and user_id in team.get("members", []):
-                can_update = True
+        membership = await get_membership(user_id)
+        can_update = membership.in_team(existing.get("team_id"))
 
     if not can_update:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -164,11 +152,8 @@ async def delete_task(task_id: str, user=Depends(require_user)):
         can_delete = True
     # User is in the task's team
     elif existing.get("team_id"):
-        team_objectid = safe_objectid(existing.get("team_id"))
-        if team_objectid:
-            team = await db.teams.find_one({"_id": team_objectid})
-            if team and user_id in team.get("members", []):
-                can_delete = True
+        membership = await get_membership(user_id)
+        can_delete = membership.in_team(existing.get("team_id"))
 
     if not can_delete:
         raise HTTPException(status_code=403, detail="Access denied")
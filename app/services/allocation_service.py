@@ -0,0 +1,439 @@
+import base64
+import hashlib
+import os
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne
+from app.config.database import db
+from app.core.permissions import invalidate_memberships
+from app.services import guide_match_service
+from app.services.auth_service import new_invite
+
+# Fields that carry allocation data; bookkeeping fields (batch_id, uploaded_by,
+# uploaded_at) are excluded so re-uploads of the same rows compare as unchanged.
+ALLOCATION_FIELDS = (
+    "group_no", "student_name", "enrollment_no", "guide_name",
+    "title_1", "title_2", "title_3", "sheet_name",
+    "team_leader", "leader_enrollment", "section",
+    "member_1", "member_1_enrollment", "member_2", "member_2_enrollment",
+    "member_3", "member_3_enrollment", "team_name",
+)
+
+
+# Filters accepted by list_allocations; each one leads a (filter, uploaded_at, _id) index
+RECORD_FILTERS = ("batch_id", "sheet_name", "guide_name", "group_no")
+RECORD_LIST_FIELDS = ALLOCATION_FIELDS + ("batch_id", "uploaded_by", "uploaded_at")
+MAX_PAGE_SIZE = 1000
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def allocation_key(doc: dict) -> dict:
+    """Identity of an allocation row: enrollment number within a sheet.
+
+    Rows without an enrollment number fall back to group + student name.
+    """
+    sheet_name = doc.get("sheet_name", "CSV")
+    if doc.get("enrollment_no"):
+        return {"sheet_name": sheet_name, "enrollment_no": doc["enrollment_no"]}
+    return {
+        "sheet_name": sheet_name,
+        "enrollment_no": "",
+        "group_no": doc.get("group_no", ""),
+        "student_name": doc.get("student_name", ""),
+    }
+
+
+def _key_tuple(key: dict) -> tuple:
+    return tuple(sorted(key.items()))
+
+
+async def find_upload_by_hash(digest: str) -> dict | None:
+    return await db.allocation_uploads.find_one({"content_hash": digest})
+
+
+async def record_upload(digest: str, batch_id: str, filename: str, uploaded_by, summary: dict):
+    await db.allocation_uploads.update_one(
+        {"content_hash": digest},
+        {"$set": {
+            "content_hash": digest,
+            "batch_id": batch_id,
+            "filename": filename,
+            "uploaded_by": uploaded_by,
+            "uploaded_at": batch_id,
+            "summary": summary,
+        }},
+        upsert=True,
+    )
+
+
+async def forget_batch_uploads(batch_id: str):
+    """Drop the content hashes of a deleted batch so the file can be uploaded again."""
+    await db.allocation_uploads.delete_many({"batch_id": batch_id})
+
+
+async def forget_orphaned_uploads():
+    """
+    Drop the content hashes of uploads that no longer own or last touched any
+    row. An upload that only updated existing rows owns none of them, so
+    deleting the batch that created those rows must release its hash too.
+    """
+    live = set(await db.allocations.distinct("batch_id")) | set(await db.allocations.distinct("last_batch_id"))
+    await db.allocation_uploads.delete_many({"batch_id": {"$nin": [b for b in live if b]}})
+
+
+async def list_uploads() -> list[dict]:
+    return [u async for u in db.allocation_uploads.find({}, {"summary": 0})]
+
+
+async def upsert_allocations(docs: list[dict]) -> dict:
+    """Apply parsed rows to db.allocations keyed on (sheet_name, enrollment_no).
+
+    New rows are inserted, rows whose data fields differ are updated and
+    identical rows are left untouched. Updated rows keep the batch_id of the
+    upload that created them (so deleting a later batch leaves them alone)
+    and record the latest upload in last_batch_id. All writes go out in one
+    unordered bulk_write.
+    """
+    incoming: dict[tuple, dict] = {}
+    for d in docs:
+        incoming[_key_tuple(allocation_key(d))] = d  # last occurrence wins
+    duplicates = len(docs) - len(incoming)
+
+    existing: dict[tuple, dict] = {}
+    by_sheet: dict[str, list[str]] = {}
+    for d in incoming.values():
+        by_sheet.setdefault(d.get("sheet_name", "CSV"), []).append(d.get("enrollment_no", ""))
+    if by_sheet:
+        query = {"$or": [
+            {"sheet_name": sheet, "enrollment_no": {"$in": list(set(enrollments))}}
+            for sheet, enrollments in by_sheet.items()
+        ]}
+        projection = {f: 1 for f in ALLOCATION_FIELDS}
+        async for e in db.allocations.find(query, projection):
+            existing.setdefault(_key_tuple(allocation_key(e)), e)
+
+    ops = []
+    inserted = updated = unchanged = 0
+    for key, d in incoming.items():
+        current = existing.get(key)
+        if current is None:
+            ops.append(UpdateOne(allocation_key(d), {"$set": {**d, "last_batch_id": d["batch_id"]}}, upsert=True))
+            inserted += 1
+            continue
+        changed = {f: d.get(f, "") for f in ALLOCATION_FIELDS if f in d and current.get(f, "") != d.get(f, "")}
+        if not changed:
+            unchanged += 1
+            continue
+        changed["last_batch_id"] = d["batch_id"]
+        ops.append(UpdateOne({"_id": current["_id"]}, {"$set": changed}))
+        updated += 1
+
+    if ops:
+        await db.allocations.bulk_write(ops, ordered=False)
+
+    return {"inserted": inserted, "updated": updated, "unchanged": unchanged, "duplicates": duplicates}
+
+
+def encode_cursor(uploaded_at: str, oid: ObjectId) -> str:
+    return base64.urlsafe_b64encode(f"{uploaded_at}|{oid}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, ObjectId]:
+    """Inverse of encode_cursor; raises ValueError on malformed input."""
+    try:
+        uploaded_at, oid = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return uploaded_at, ObjectId(oid)
+    except (InvalidId, TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def list_allocations(filters: dict, cursor: str | None = None, limit: int = 100, fields: list[str] | None = None) -> dict:
+    """Keyset-paginate db.allocations newest first on (uploaded_at, _id)."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = {k: v for k, v in filters.items() if k in RECORD_FILTERS and v is not None}
+    if cursor:
+        uploaded_at, oid = decode_cursor(cursor)
+        query["$or"] = [
+            {"uploaded_at": {"$lt": uploaded_at}},
+            {"uploaded_at": uploaded_at, "_id": {"$lt": oid}},
+        ]
+
+    wanted = [f for f in (fields or RECORD_LIST_FIELDS) if f in RECORD_LIST_FIELDS]
+    projection = {f: 1 for f in wanted}
+    projection["uploaded_at"] = 1  # needed for the cursor
+
+    items = []
+    last = None
+    docs = db.allocations.find(query, projection).sort([("uploaded_at", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1)
+    async for d in docs:
+        if len(items) == limit:
+            break
+        last = (d.get("uploaded_at", ""), d["_id"])
+        d["id"] = str(d.pop("_id"))
+        if isinstance(d.get("uploaded_by"), ObjectId):
+            d["uploaded_by"] = str(d["uploaded_by"])
+        if "uploaded_at" not in wanted:
+            d.pop("uploaded_at", None)
+        items.append(d)
+    else:
+        last = None  # fewer than limit + 1 rows: this is the last page
+
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(*last) if last else None,
+        "limit": limit,
+    }
+
+
+# --------------------------------------------------------
+# Materialize allocation rows into users, teams and projects
+# --------------------------------------------------------
+STUDENT_EMAIL_DOMAIN = os.getenv("STUDENT_EMAIL_DOMAIN", "students.local")
+
+
+async def resolve_guides(guide_names: set[str]) -> dict[str, str | None]:
+    matches = await guide_match_service.match_names(guide_names)
+    return {name: m["mentor_id"] for name, m in matches.items()}
+
+
+def _row_students(row: dict) -> list[tuple[str, str]]:
+    """(name, enrollment_no) pairs on a row; form responses carry the whole team."""
+    students = [(row.get("student_name", ""), row.get("enrollment_no", ""))]
+    for i in (1, 2, 3):
+        students.append((row.get(f"member_{i}", ""), row.get(f"member_{i}_enrollment", "")))
+    return [(n, e) for n, e in students if e]
+
+
+# Merged cells in the allotment workbook leave these blank on every row of a
+# group but the first
+_MERGED_FIELDS = ("group_no", "guide_name", "title_1")
+
+
+def _forward_fill(rows: list[dict]) -> list[dict]:
+    """
+    Copy group_no, guide_name and title_1 down onto the continuation rows of a
+    group, per upload and sheet in row order. Returns new dicts; a row that
+    has its own group_no starts a new group and is left as it is.
+    """
+    filled, last = [], {}
+    for r in sorted(rows, key=lambda r: r["_id"]):
+        key = (r.get("batch_id"), r.get("sheet_name", "CSV"))
+        if r.get("group_no"):
+            last[key] = r
+        elif key in last:
+            r = {**r, **{f: r.get(f) or last[key].get(f, "") for f in _MERGED_FIELDS}}
+        filled.append(r)
+    return filled
+
+
+def _group_rows(rows: list[dict]) -> dict[tuple, dict]:
+    groups: dict[tuple, dict] = {}
+    for r in rows:
+        if not r.get("group_no"):
+            continue
+        key = (r.get("sheet_name", "CSV"), r["group_no"])
+        g = groups.setdefault(key, {"students": {}, "guide_name": "", "title": "", "team_name": ""})
+        for name, enrollment in _row_students(r):
+            g["students"].setdefault(enrollment, name)
+        g["guide_name"] = g["guide_name"] or r.get("guide_name", "")
+        g["title"] = g["title"] or r.get("title_1", "")
+        g["team_name"] = g["team_name"] or r.get("team_name", "")
+    return groups
+
+
+async def materialize_allocations(batch_id: str | None, created_by: str, dry_run: bool = True) -> dict:
+    """Create or update student users, teams and projects from allocation rows.
+
+    Rows are grouped by (sheet_name, group_no), after filling merged group
+    cells down onto the rows below them, and guide names are resolved to
+    mentor/panel users. Existing documents are read up front so new documents
+    get their ObjectIds in advance, which lets each collection be written with
+    a single unordered bulk_write. With dry_run nothing is written and only
+    the planned changes are returned.
+
+    New student accounts get no password; each gets a one-time invite token
+    (returned in "invites") for POST /auth/set-password.
+    """
+    query = {"batch_id": batch_id} if batch_id else {}
+    rows = [r async for r in db.allocations.find(query, {"batch_id": 1, **{f: 1 for f in ALLOCATION_FIELDS}})]
+    rows = _forward_fill(rows)
+    groups = _group_rows(rows)
+    mentors = await resolve_guides({g["guide_name"] for g in groups.values() if g["guide_name"]})
+    now = datetime.utcnow().isoformat()
+
+    # ---- users, keyed on enrollment_no, or on the student email for accounts registered without one ----
+    enrollments: dict[str, tuple[str, str | None]] = {}
+    for g in groups.values():
+        for enrollment, name in g["students"].items():
+            enrollments.setdefault(enrollment, (name, mentors.get(g["guide_name"])))
+    emails = {e: f"{e.lower()}@{STUDENT_EMAIL_DOMAIN}" for e in enrollments}
+    by_enrollment, by_email = {}, {}
+    user_query = {"$or": [{"enrollment_no": {"$in": list(enrollments)}}, {"email": {"$in": list(emails.values())}}]}
+    async for u in db.users.find(user_query, {"enrollment_no": 1, "email": 1, "mentor_id": 1}):
+        if u.get("enrollment_no"):
+            by_enrollment.setdefault(u["enrollment_no"], u)
+        by_email.setdefault(u.get("email"), u)
+
+    user_ops = []
+    invites = []
+    student_ids: dict[str, str] = {}
+    users_created = users_updated = 0
+    for enrollment, (name, mentor_id) in enrollments.items():
+        current = by_enrollment.get(enrollment) or by_email.get(emails[enrollment])
+        if current is None:
+            oid = ObjectId()
+            users_created += 1
+            doc = {
+                "_id": oid,
+                "username": name or enrollment,
+                "email": emails[enrollment],
+                "password": None,
+                "role": "student",
+                "enrollment_no": enrollment,
+                "mentor_id": mentor_id,
+                "created_at": now,
+            }
+            if not dry_run:
+                token, invite = new_invite()
+                doc.update(invite)
+                invites.append({"user_id": str(oid), "email": doc["email"], "enrollment_no": enrollment, "invite_token": token})
+            user_ops.append(InsertOne(doc))
+        else:
+            oid = current["_id"]
+            changes = {}
+            if current.get("enrollment_no") != enrollment:
+                changes["enrollment_no"] = enrollment
+            if mentor_id and current.get("mentor_id") != mentor_id:
+                changes["mentor_id"] = mentor_id
+            if changes:
+                users_updated += 1
+                user_ops.append(UpdateOne({"_id": oid}, {"$set": changes}))
+        student_ids[enrollment] = str(oid)
+
+    # ---- teams, keyed on (allocation_sheet, allocation_group) ----
+    existing_teams: dict[tuple, dict] = {}
+    if groups:
+        team_query = {"$or": [
+            {"allocation_sheet": sheet, "allocation_group": {"$in": [gn for s, gn in groups if s == sheet]}}
+            for sheet in {s for s, _ in groups}
+        ]}
+        async for t in db.teams.find(team_query, {"allocation_sheet": 1, "allocation_group": 1, "members": 1, "mentor_id": 1}):
+            existing_teams[(t["allocation_sheet"], t["allocation_group"])] = t
+
+    new_teams: dict[tuple, dict] = {}
+    team_updates: dict[tuple, dict] = {}
+    team_ids: dict[tuple, str] = {}
+    for key, g in groups.items():
+        members = [student_ids[e] for e in g["students"]]
+        mentor_id = mentors.get(g["guide_name"])
+        current = existing_teams.get(key)
+        if current is None:
+            doc = {
+                "_id": ObjectId(),
+                "name": g["team_name"] or f"{key[0]} {key[1]}",
+                "members": members,
+                "mentor_id": mentor_id,
+                "description": None,
+                "created_by": created_by,
+                "created_at": now,
+                "allocation_sheet": key[0],
+                "allocation_group": key[1],
+            }
+            new_teams[key] = doc
+            team_ids[key] = str(doc["_id"])
+            continue
+        team_ids[key] = str(current["_id"])
+        update = {}
+        known = {str(m) for m in current.get("members", [])}
+        missing = [m for m in members if m not in known]
+        if missing:
+            update["$addToSet"] = {"members": {"$each": missing}}
+        if mentor_id and current.get("mentor_id") != mentor_id:
+            update["$set"] = {"mentor_id": mentor_id}
+        if update:
+            team_updates[key] = update
+
+    # ---- projects, one per team from title_1 ----
+    existing_projects: dict[str, dict] = {}
+    async for p in db.projects.find({"team_id": {"$in": list(team_ids.values())}}, {"team_id": 1, "title": 1, "mentor_id": 1}):
+        existing_projects.setdefault(p["team_id"], p)
+
+    project_ops = []
+    projects_created = projects_updated = 0
+    for key, g in groups.items():
+        if not g["title"]:
+            continue
+        mentor_id = mentors.get(g["guide_name"])
+        current = existing_projects.get(team_ids[key])
+        if current is None:
+            oid = ObjectId()
+            projects_created += 1
+            project_ops.append(InsertOne({
+                "_id": oid,
+                "title": g["title"],
+                "description": None,
+                "team_id": team_ids[key],
+                "mentor_id": mentor_id,
+                "status": "active",
+                "created_by": created_by,
+            }))
+            # Link the team to its new project within the same teams bulk_write
+            if key in new_teams:
+                new_teams[key]["project_id"] = str(oid)
+            else:
+                team_updates.setdefault(key, {}).setdefault("$set", {})["project_id"] = str(oid)
+            continue
+        changes = {}
+        if current.get("title") != g["title"]:
+            changes["title"] = g["title"]
+        if mentor_id and current.get("mentor_id") != mentor_id:
+            changes["mentor_id"] = mentor_id
+        if changes:
+            projects_updated += 1
+            project_ops.append(UpdateOne({"_id": current["_id"]}, {"$set": changes}))
+
+    team_ops = [InsertOne(doc) for doc in new_teams.values()]
+    team_ops += [UpdateOne({"_id": existing_teams[key]["_id"]}, update) for key, update in team_updates.items()]
+
+    if not dry_run:
+        if user_ops:
+            await db.users.bulk_write(user_ops, ordered=False)
+        if team_ops:
+            await db.teams.bulk_write(team_ops, ordered=False)
+        if project_ops:
+            await db.projects.bulk_write(project_ops, ordered=False)
+        if team_ops or project_ops:
+            invalidate_memberships()
+
+    return {
+        "dry_run": dry_run,
+        "batch_id": batch_id,
+        "groups": len(groups),
+        "users": {"create": users_created, "update": users_updated, "unchanged": len(enrollments) - users_created - users_updated},
+        "teams": {"create": len(new_teams), "update": len(team_updates), "unchanged": len(groups) - len(new_teams) - len(team_updates)},
+        "projects": {"create": projects_created, "update": projects_updated},
+        "unmatched_guides": sorted(name for name, mentor_id in mentors.items() if not mentor_id),
+        "skipped_rows": len([r for r in rows if not r.get("group_no")]),
+        "invites": invites,
+    }
+
+
+async def ensure_indexes():
+    await db.allocation_uploads.create_index([("content_hash", ASCENDING)], unique=True)
+    await db.allocation_uploads.create_index([("batch_id", ASCENDING)])
+    await db.allocations.create_index([("sheet_name", ASCENDING), ("enrollment_no", ASCENDING)])
+    await db.allocations.create_index([("last_batch_id", ASCENDING)], sparse=True)
+    # Keyset pagination for /csv/records, unfiltered and per filter
+    await db.allocations.create_index([("uploaded_at", DESCENDING), ("_id", DESCENDING)])
+    for field in RECORD_FILTERS:
+        await db.allocations.create_index([(field, ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)])
+    # Lookups made by materialize_allocations
+    await db.users.create_index([("enrollment_no", ASCENDING)], sparse=True)
+    await db.users.create_index([("email", ASCENDING)])
+    await db.users.create_index([("invite_token_hash", ASCENDING)], sparse=True)
+    await db.teams.create_index([("allocation_sheet", ASCENDING), ("allocation_group", ASCENDING)], sparse=True)
+    await db.projects.create_index([("team_id", ASCENDING)])
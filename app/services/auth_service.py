@@ -1,10 +1,14 @@
 # app/services/auth_service.py
+import hashlib
+import os
+import secrets
 from passlib.context import CryptContext
-from datetime import timedelta
+from datetime import datetime, timedelta
 from jose import jwt
 from app.config.database import SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+INVITE_TTL_HOURS = int(os.getenv("INVITE_TTL_HOURS", "168"))
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password[:72])
@@ -12,6 +16,17 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password[:72], hashed_password)
 
+def invite_token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def new_invite() -> tuple[str, dict]:
+    """One-time set-password token and the user fields to store for it (only its hash is kept)"""
+    token = secrets.token_urlsafe(32)
+    return token, {
+        "invite_token_hash": invite_token_hash(token),
+        "invite_expires_at": datetime.utcnow() + timedelta(hours=INVITE_TTL_HOURS),
+    }
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     from datetime import datetime
@@ -1,7 +1,13 @@
+import numpy as np
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, UpdateOne
 from app.config.database import db
+from app.core.mongodb_utils import safe_objectid
 from datetime import datetime
 
+RUBRIC_FIELDS = ("technical_implementation", "presentation_clarity", "problem_solving", "overall_impression")
+MAX_BULK_EVALUATIONS = 200
+
 def serialize_feedback(fb):
     """Convert MongoDB document to Python dict matching Pydantic model."""
     return {
@@ -9,6 +15,7 @@ def serialize_feedback(fb):
         "team_id": fb["team_id"],
         "project_id": fb["project_id"],
         "round_number": fb["round_number"],
+        "presentation_id": fb.get("presentation_id"),
         "evaluator_id": fb["evaluator_id"],
         "score": fb["score"],
         "comments": fb.get("comments"),
@@ -18,7 +25,12 @@ def serialize_feedback(fb):
 async def submit_feedback(feedback_data: dict):
     feedback_data["created_at"] = datetime.utcnow().isoformat()
     result = await db.feedback.insert_one(feedback_data)
-    return str(result.inserted_id)
+    feedback_id = str(result.inserted_id)
+    presentation_oid = safe_objectid(feedback_data.get("presentation_id"))
+    if presentation_oid:
+        await db.presentations.update_one({"_id": presentation_oid}, {"$addToSet": {"feedback_ids": feedback_id}})
+    await _record_scores([feedback_data])
+    return feedback_id
 
 async def get_feedback_by_id(feedback_id: str):
     fb = await db.feedback.find_one({"_id": ObjectId(feedback_id)})
@@ -30,3 +42,219 @@ async def get_feedback_by_team(team_id: str):
     async for f in cursor:
         feedbacks.append(serialize_feedback(f))
     return feedbacks
+
+
+def evaluation_doc(pres: dict, presentation_id: str, evaluator_id: str, scores: dict, comments: str | None) -> dict:
+    """Feedback document for a rubric evaluation of a presentation; the score is the rubric total"""
+    return {
+        "team_id": pres.get("team_id"),
+        "project_id": pres.get("project_id"),
+        "round_number": pres.get("round_number"),
+        "presentation_id": presentation_id,
+        "evaluator_id": evaluator_id,
+        "score": sum(scores[f] for f in RUBRIC_FIELDS),
+        "comments": comments,
+    }
+
+
+async def submit_evaluations(evaluations: list[dict], evaluator_id: str) -> list[dict]:
+    """
+    Store many rubric evaluations at once: one $in to validate the
+    presentations, one insert_many, one bulk_write linking feedback_ids and
+    one for the leaderboard. Returns a status per item, in input order.
+    """
+    results = [{"index": i, "presentation_id": e.get("presentation_id")} for i, e in enumerate(evaluations)]
+    oids = {}
+    for r in results:
+        oid = safe_objectid(r["presentation_id"])
+        if oid:
+            oids[r["presentation_id"]] = oid
+        else:
+            r.update(status="error", detail="Invalid presentation ID")
+    presentations = {}
+    if oids:
+        async for p in db.presentations.find({"_id": {"$in": list(oids.values())}}, {"team_id": 1, "project_id": 1, "round_number": 1}):
+            presentations[str(p["_id"])] = p
+
+    created_at = datetime.utcnow().isoformat()
+    docs, pending = [], []
+    for e, r in zip(evaluations, results):
+        if "status" in r:
+            continue
+        pres = presentations.get(r["presentation_id"])
+        if not pres:
+            r.update(status="error", detail="Presentation not found")
+            continue
+        doc = evaluation_doc(pres, r["presentation_id"], evaluator_id, e, e.get("comments"))
+        doc["created_at"] = created_at
+        docs.append(doc)
+        pending.append(r)
+    if not docs:
+        return results
+
+    inserted = await db.feedback.insert_many(docs)
+    linked: dict[str, list[str]] = {}
+    for doc, r, fid in zip(docs, pending, inserted.inserted_ids):
+        r.update(status="created", feedback_id=str(fid), score=doc["score"])
+        linked.setdefault(doc["presentation_id"], []).append(str(fid))
+    await db.presentations.bulk_write(
+        [UpdateOne({"_id": oids[pid]}, {"$addToSet": {"feedback_ids": {"$each": fids}}}) for pid, fids in linked.items()],
+        ordered=False,
+    )
+    await _record_scores(docs)
+    return results
+
+
+# --------------------------------------------------------
+# Score statistics
+# --------------------------------------------------------
+STATS_PROJECTION = {"evaluator_id": 1, "score": 1, "team_id": 1, "round_number": 1}
+
+
+def score_stats(rows: list[dict]) -> dict:
+    """count/mean/median/std (population) of the scores, plus the spread between evaluators' mean scores"""
+    rows = [r for r in rows if r.get("score") is not None]
+    if not rows:
+        return {"count": 0, "mean": None, "median": None, "std": None, "min": None, "max": None, "evaluators": 0, "evaluator_spread": None}
+    scores = np.array([float(r["score"]) for r in rows])
+    evaluators, which = np.unique([str(r.get("evaluator_id")) for r in rows], return_inverse=True)
+    evaluator_means = np.bincount(which, weights=scores) / np.bincount(which)
+    return {
+        "count": int(scores.size),
+        "mean": round(float(scores.mean()), 3),
+        "median": round(float(np.median(scores)), 3),
+        "std": round(float(scores.std()), 3),
+        "min": float(scores.min()),
+        "max": float(scores.max()),
+        "evaluators": int(evaluators.size),
+        "evaluator_spread": round(float(evaluator_means.max() - evaluator_means.min()), 3),
+    }
+
+
+async def presentation_stats(presentation_id: str) -> dict | None:
+    oid = safe_objectid(presentation_id)
+    pres = await db.presentations.find_one({"_id": oid}, {"team_id": 1, "round_number": 1}) if oid else None
+    if not pres:
+        return None
+    # Feedback given before presentation_id was recorded is matched by team and round
+    query = {"$or": [
+        {"presentation_id": presentation_id},
+        {"team_id": pres.get("team_id"), "round_number": pres.get("round_number"), "presentation_id": None},
+    ]}
+    rows = [r async for r in db.feedback.find(query, STATS_PROJECTION)]
+    return {"presentation_id": presentation_id, "team_id": pres.get("team_id"), "round_number": pres.get("round_number"), **score_stats(rows)}
+
+
+async def team_stats(team_id: str) -> dict:
+    rows = [r async for r in db.feedback.find({"team_id": team_id}, STATS_PROJECTION)]
+    rounds: dict[int, list[dict]] = {}
+    for r in rows:
+        rounds.setdefault(r.get("round_number"), []).append(r)
+    return {
+        "team_id": team_id,
+        "overall": score_stats(rows),
+        "rounds": [{"round_number": n, **score_stats(rounds[n])} for n in sorted(rounds, key=lambda n: (n is None, n))],
+    }
+
+
+async def round_stats(round_number: int) -> dict:
+    rows = [r async for r in db.feedback.find({"round_number": round_number}, STATS_PROJECTION)]
+    return {"round_number": round_number, "teams": len({r.get("team_id") for r in rows}), **score_stats(rows)}
+
+
+# --------------------------------------------------------
+# Round leaderboard: one running-total document per (round, team), updated
+# as feedback comes in, so reading the leaderboard is an indexed sorted scan
+# --------------------------------------------------------
+def _plus(field: str, value):
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, value]}
+
+
+def _leaderboard_ops(feedbacks: list[dict]) -> list[UpdateOne]:
+    """One running-total update per (round, team) covering all the given feedback"""
+    totals: dict[tuple, list] = {}
+    for fb in feedbacks:
+        if fb.get("score") is None or fb.get("round_number") is None or not fb.get("team_id"):
+            continue
+        score = float(fb["score"])
+        t = totals.setdefault((fb["round_number"], fb["team_id"]), [fb.get("project_id"), 0, 0.0, 0.0])
+        t[1] += 1
+        t[2] += score
+        t[3] += score * score
+    return [
+        UpdateOne(
+            {"round_number": round_number, "team_id": team_id},
+            [
+                {"$set": {
+                    "project_id": project_id,
+                    "count": _plus("count", count),
+                    "sum": _plus("sum", total),
+                    "sum_sq": _plus("sum_sq", total_sq),
+                    "updated_at": datetime.utcnow(),
+                }},
+                {"$set": {"mean": {"$divide": ["$sum", "$count"]}}},
+            ],
+            upsert=True,
+        )
+        for (round_number, team_id), (project_id, count, total, total_sq) in totals.items()
+    ]
+
+
+async def _record_scores(feedbacks: list[dict]):
+    ops = _leaderboard_ops(feedbacks)
+    if ops:
+        await db.round_leaderboard.bulk_write(ops)
+
+
+def _leaderboard_out(doc: dict, rank: int) -> dict:
+    mean = doc["sum"] / doc["count"]
+    return {
+        "rank": rank,
+        "team_id": doc["team_id"],
+        "project_id": doc.get("project_id"),
+        "count": doc["count"],
+        "mean": round(mean, 3),
+        "std": round(max(doc["sum_sq"] / doc["count"] - mean * mean, 0.0) ** 0.5, 3),
+    }
+
+
+async def get_leaderboard(round_number: int, limit: int = 50) -> list[dict]:
+    cursor = db.round_leaderboard.find({"round_number": round_number}).sort([("mean", DESCENDING), ("count", DESCENDING)]).limit(limit)
+    return [_leaderboard_out(doc, rank) for rank, doc in enumerate(await cursor.to_list(limit), start=1)]
+
+
+async def rebuild_leaderboard(round_number: int) -> int:
+    """Recompute a round's leaderboard from the feedback collection (for data predating it)"""
+    ops, team_ids = [], []
+    async for g in db.feedback.aggregate([
+        {"$match": {"round_number": round_number, "score": {"$ne": None}}},
+        {"$sort": {"created_at": 1}},  # so $last picks the most recent project_id
+        {"$group": {
+            "_id": "$team_id",
+            "project_id": {"$last": "$project_id"},
+            "count": {"$sum": 1},
+            "sum": {"$sum": "$score"},
+            "sum_sq": {"$sum": {"$multiply": ["$score", "$score"]}},
+        }},
+    ]):
+        if g["_id"]:
+            team_ids.append(g["_id"])
+            key = {"round_number": round_number, "team_id": g["_id"]}
+            ops.append(ReplaceOne(key, {
+                **key, "project_id": g.get("project_id"),
+                "count": g["count"], "sum": g["sum"], "sum_sq": g["sum_sq"],
+                "mean": g["sum"] / g["count"], "updated_at": datetime.utcnow(),
+            }, upsert=True))
+    # replace in place so readers never see an empty board mid-rebuild
+    if ops:
+        await db.round_leaderboard.bulk_write(ops, ordered=False)
+    await db.round_leaderboard.delete_many({"round_number": round_number, "team_id": {"$nin": team_ids}})
+    return len(ops)
+
+
+async def ensure_indexes():
+    await db.feedback.create_index([("team_id", ASCENDING), ("round_number", ASCENDING)])
+    await db.feedback.create_index([("round_number", ASCENDING)])
+    await db.feedback.create_index([("presentation_id", ASCENDING)], sparse=True)
+    await db.round_leaderboard.create_index([("round_number", ASCENDING), ("team_id", ASCENDING)], unique=True)
+    await db.round_leaderboard.create_index([("round_number", ASCENDING), ("mean", DESCENDING), ("count", DESCENDING)])
@@ -0,0 +1,201 @@
+import asyncio
+import contextlib
+import os
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import formatdate
+from bson import ObjectId
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from app.services import file_service
+
+# On-disk LRU cache of GridFS content, bounded by total bytes. Entries are
+# named by GridFS id; since GridFS files are immutable they never go stale.
+# A cache file's mtime is set to the GridFS upload date so Last-Modified
+# survives restarts.
+CACHE_DIR = os.getenv("FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pm_file_cache"))
+CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+_entries: "OrderedDict[str, int]" = OrderedDict()  # gridfs_id -> size, least recently used first
+_total_bytes = 0
+_loaded = False
+_inflight: dict[str, asyncio.Task] = {}
+_pinned: dict[str, int] = {}  # gridfs_id -> responses currently sending it; never evicted
+
+
+def enabled() -> bool:
+    return CACHE_MAX_BYTES > 0
+
+
+def _path(gridfs_id: str) -> str:
+    return os.path.join(CACHE_DIR, gridfs_id)
+
+
+def _load():
+    """Index files left by a previous run, oldest first."""
+    global _loaded, _total_bytes
+    if _loaded:
+        return
+    _loaded = True
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    found = []
+    for name in os.listdir(CACHE_DIR):
+        path = _path(name)
+        if name.endswith(".part"):
+            os.remove(path)
+            continue
+        st = os.stat(path)
+        found.append((st.st_atime, name, st.st_size))
+    for _, name, size in sorted(found):
+        _entries[name] = size
+        _total_bytes += size
+
+
+def _evict(needed: int):
+    global _total_bytes
+    for gridfs_id in list(_entries):
+        if _total_bytes + needed <= CACHE_MAX_BYTES:
+            break
+        if _pinned.get(gridfs_id):
+            continue
+        _total_bytes -= _entries.pop(gridfs_id)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_path(gridfs_id))
+
+
+def _forget(gridfs_id: str):
+    global _total_bytes
+    if gridfs_id in _entries:
+        _total_bytes -= _entries.pop(gridfs_id)
+
+
+class _PinnedFileResponse(FileResponse):
+    """FileResponse whose cache entry cannot be evicted until it has been sent"""
+
+    def __init__(self, gridfs_id: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gridfs_id = gridfs_id
+        _pinned[gridfs_id] = _pinned.get(gridfs_id, 0) + 1
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _pinned[self.gridfs_id] -= 1
+            if not _pinned[self.gridfs_id]:
+                del _pinned[self.gridfs_id]
+
+
+def lookup(gridfs_id: str) -> str | None:
+    """Path of the cached copy, marking it most recently used."""
+    if not enabled():
+        return None
+    _load()
+    if gridfs_id not in _entries:
+        return None
+    path = _path(gridfs_id)
+    if not os.path.exists(path):
+        # Evicted by another worker sharing the directory
+        _forget(gridfs_id)
+        return None
+    _entries.move_to_end(gridfs_id)
+    return path
+
+
+async def _fill(gridfs_id: str):
+    global _total_bytes
+    grid_out = await file_service.get_file_stream(gridfs_id)
+    if not grid_out or grid_out.length > CACHE_MAX_BYTES // 4:
+        return  # missing, or too large to be worth a quarter of the cache
+    _evict(grid_out.length)
+    part = _path(gridfs_id) + ".part"
+    try:
+        with open(part, "wb") as fh:
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                await asyncio.to_thread(fh.write, chunk)
+        modified = grid_out.upload_date.replace(tzinfo=timezone.utc).timestamp()
+        os.utime(part, (modified, modified))
+        os.replace(part, _path(gridfs_id))
+    finally:
+        # Only left behind if the copy failed part way
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(part)
+    _entries[gridfs_id] = grid_out.length
+    _total_bytes += grid_out.length
+
+
+def _start_fill(gridfs_id: str) -> asyncio.Task:
+    """Start (or join) the fill of one id; concurrent requests share a single copy job."""
+    task = _inflight.get(gridfs_id)
+    if task is None:
+        task = asyncio.create_task(_fill(gridfs_id))
+        _inflight[gridfs_id] = task
+
+        def done(t: asyncio.Task):
+            _inflight.pop(gridfs_id, None)
+            if not t.cancelled() and t.exception():
+                print(f"file cache fill failed for {gridfs_id}: {t.exception()}")
+        task.add_done_callback(done)
+    return task
+
+
+async def fill(gridfs_id: str):
+    """Copy a GridFS file into the cache and wait for it."""
+    if not enabled() or lookup(gridfs_id):
+        return
+    try:
+        await _start_fill(gridfs_id)
+    except Exception:
+        pass  # already logged by the done callback
+
+
+async def download_response(request: Request, gridfs_id: str, filename: str, content_type: str | None = None, headers: dict | None = None) -> Response | None:
+    """
+    Serve a GridFS file, from the disk cache when possible. Cache hits are
+    sent as a FileResponse (which can use the server's pathsend/zero-copy path
+    and handles Range itself); misses stream from GridFS and warm the cache.
+    Returns None if the GridFS file does not exist.
+    """
+    path = lookup(gridfs_id)
+    stat_result = None
+    if path:
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            _forget(gridfs_id)  # removed since the lookup; serve from GridFS instead
+    if stat_result:
+        modified = datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc)
+        etag = f'"{gridfs_id}"'
+        base_headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(modified.timestamp(), usegmt=True),
+            "Content-Disposition": file_service.content_disposition(filename),
+            **(headers or {}),
+        }
+        if file_service.not_modified(request, etag, modified):
+            return Response(status_code=304, headers=base_headers)
+        return _PinnedFileResponse(gridfs_id, path, media_type=file_service.content_type_for(filename, content_type),
+                                   headers=base_headers, stat_result=stat_result)
+
+    grid_out = await file_service.get_file_stream(gridfs_id)
+    if not grid_out:
+        return None
+    if enabled():
+        _start_fill(gridfs_id)
+    return file_service.gridfs_download_response(request, grid_out, filename, content_type, headers)
+
+
+async def prefetch(gridfs_ids: list[str]) -> int:
+    """Warm the cache for the given GridFS ids in the background; returns how many were scheduled."""
+    if not enabled():
+        return 0
+    scheduled = 0
+    for gridfs_id in dict.fromkeys(gridfs_ids):
+        if ObjectId.is_valid(gridfs_id) and not lookup(gridfs_id):
+            _start_fill(gridfs_id)
+            scheduled += 1
+    return scheduled
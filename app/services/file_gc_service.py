@@ -0,0 +1,223 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.config.database import db
+from app.core.mongodb_utils import safe_objectid_list
+from app.services import file_service
+
+# Garbage collection of stored files. References run
+#   teams -> presentations.file_ids / projects -> db.files -> db.blobs -> files.files -> files.chunks
+# and each sweep removes entries nothing points at any more. Only entries
+# whose ObjectId is older than GC_GRACE_SECONDS are considered, so uploads
+# that are still being written or linked are never touched. Work is done in
+# batches of GC_BATCH_SIZE with a pause in between to keep the load low.
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "500"))
+GC_PAUSE_SECONDS = float(os.getenv("GC_PAUSE_SECONDS", "0.2"))
+GC_GRACE_SECONDS = int(os.getenv("GC_GRACE_SECONDS", "3600"))
+GC_INTERVAL_HOURS = float(os.getenv("GC_INTERVAL_HOURS", "6"))
+
+gridfs_files = db["files.files"]
+gridfs_chunks = db["files.chunks"]
+
+
+def _cutoff() -> ObjectId:
+    return ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=GC_GRACE_SECONDS))
+
+
+async def _batches(collection, query: dict, projection: dict):
+    """Yield lists of documents in _id order, older than the grace cutoff, pausing between batches."""
+    last = None
+    cutoff = _cutoff()
+    while True:
+        id_range = {"$lt": cutoff}
+        if last is not None:
+            id_range["$gt"] = last
+        batch = await collection.find({**query, "_id": id_range}, projection).sort("_id", 1).limit(GC_BATCH_SIZE).to_list(GC_BATCH_SIZE)
+        if not batch:
+            return
+        last = batch[-1]["_id"]
+        yield batch
+        await asyncio.sleep(GC_PAUSE_SECONDS)
+
+
+async def _ids_present(collection, field: str, values: list) -> set[str]:
+    if not values:
+        return set()
+    return {str(d[field]) async for d in collection.find({field: {"$in": values}}, {field: 1})}
+
+
+async def _sweep_presentations(report: dict, dry_run: bool) -> list:
+    """Presentations whose team was deleted; returns their ids so a dry run can count their files too"""
+    doomed = []
+    async for batch in _batches(db.presentations, {}, {"team_id": 1}):
+        team_ids = safe_objectid_list([p.get("team_id") for p in batch])
+        team_present = await _ids_present(db.teams, "_id", team_ids)
+        dangling = [
+            p["_id"] for p in batch
+            if p.get("team_id") and ObjectId.is_valid(str(p["team_id"])) and str(p["team_id"]) not in team_present
+        ]
+        if not dangling:
+            continue
+        report["presentations"] += len(dangling)
+        doomed += dangling
+        if not dry_run:
+            await db.presentations.delete_many({"_id": {"$in": dangling}})
+    return doomed
+
+
+async def _sweep_file_docs(report: dict, dry_run: bool, doomed_presentations: list = ()):
+    """db.files documents whose content is gone, whose project was deleted, or (presentation files) no presentation lists"""
+    projection = {"gridfs_id": 1, "sha256": 1, "length": 1, "project_id": 1, "uploaded_at": 1, "data_size": {"$binarySize": "$data"}}
+    async for batch in _batches(db.files, {}, projection):
+        gridfs_present = await _ids_present(gridfs_files, "_id", safe_objectid_list([f.get("gridfs_id") for f in batch]))
+        project_present = await _ids_present(db.projects, "_id", safe_objectid_list([f.get("project_id") for f in batch]))
+        # Presentation uploads carry uploaded_at and no project_id key
+        presentation_files = [str(f["_id"]) for f in batch if "project_id" not in f and "uploaded_at" in f]
+        listed = set()
+        if presentation_files:
+            listing = {"file_ids": {"$in": presentation_files}, "_id": {"$nin": list(doomed_presentations)}}
+            async for p in db.presentations.find(listing, {"file_ids": 1}):
+                listed.update(str(fid) for fid in p.get("file_ids", []))
+
+        # Documents created by an upload session that is still being finalized
+        in_flight = await _ids_present(db.upload_sessions, "ref_id", [f["_id"] for f in batch])
+
+        dangling = []
+        for f in batch:
+            fid = str(f["_id"])
+            if fid in in_flight:
+                continue
+            if f.get("gridfs_id"):
+                missing_content = str(f["gridfs_id"]) not in gridfs_present
+            else:
+                missing_content = not f.get("data_size")
+            orphaned = (
+                (f.get("project_id") and str(f["project_id"]) not in project_present)
+                or (fid in presentation_files and fid not in listed)
+            )
+            if missing_content or orphaned:
+                dangling.append(f)
+        if not dangling:
+            continue
+
+        report["file_docs"] += len(dangling)
+        if dry_run:
+            report["bytes_reclaimed"] += sum(f.get("length") or f.get("data_size") or 0 for f in dangling)
+            continue
+        await db.files.delete_many({"_id": {"$in": [f["_id"] for f in dangling]}})
+        for f in dangling:
+            report["bytes_reclaimed"] += f.get("data_size") or 0
+            if f.get("gridfs_id") and await file_service.release_blob(str(f["_id"]), f.get("sha256"), f.get("gridfs_id")):
+                report["bytes_reclaimed"] += f.get("length") or 0
+
+
+async def _sweep_blobs(report: dict, dry_run: bool):
+    """Drop blob references to db.files documents that no longer exist; free blobs left without any"""
+    cutoff = _cutoff()
+    last = None
+    while True:
+        query = {"_id": {"$gt": last}} if last is not None else {}
+        batch = await db.blobs.find(query, {"refs": 1, "gridfs_id": 1, "length": 1}).sort("_id", 1).limit(GC_BATCH_SIZE).to_list(GC_BATCH_SIZE)
+        if not batch:
+            return
+        last = batch[-1]["_id"]
+        refs = [r for b in batch for r in b.get("refs", [])]
+        ref_oids = safe_objectid_list(refs)
+        present = await _ids_present(db.files, "_id", ref_oids)
+        present |= await _ids_present(db.upload_sessions, "ref_id", ref_oids)
+        for b in batch:
+            # References younger than the grace period may belong to a document being created
+            stale = [r for r in b.get("refs", []) if r not in present and ObjectId.is_valid(r) and ObjectId(r) < cutoff]
+            remaining = len(b.get("refs", [])) - len(stale)
+            if not stale and remaining:
+                continue
+            report["blob_refs"] += len(stale)
+            if remaining:
+                if not dry_run:
+                    await db.blobs.update_one({"_id": b["_id"]}, {"$pull": {"refs": {"$in": stale}}})
+                continue
+            report["blobs"] += 1
+            report["bytes_reclaimed"] += b.get("length") or 0
+            if dry_run:
+                continue
+            result = await db.blobs.delete_one({"_id": b["_id"], "refs": {"$not": {"$elemMatch": {"$nin": stale}}}})
+            if result.deleted_count:
+                try:
+                    await file_service.bucket.delete(ObjectId(b["gridfs_id"]))
+                except Exception:
+                    pass  # content already gone; the blob entry was the dangling part
+        await asyncio.sleep(GC_PAUSE_SECONDS)
+
+
+async def _sweep_gridfs_files(report: dict, dry_run: bool):
+    """files.files entries referenced by no blob, no db.files document and no upload session"""
+    async for batch in _batches(gridfs_files, {}, {"length": 1}):
+        ids = [f["_id"] for f in batch]
+        as_str = [str(i) for i in ids]
+        referenced = await _ids_present(db.blobs, "gridfs_id", as_str)
+        referenced |= await _ids_present(db.files, "gridfs_id", as_str)
+        referenced |= await _ids_present(db.upload_sessions, "gridfs_id", ids)
+        unreferenced = [f for f in batch if str(f["_id"]) not in referenced]
+        if not unreferenced:
+            continue
+        report["gridfs_files"] += len(unreferenced)
+        report["bytes_reclaimed"] += sum(f.get("length") or 0 for f in unreferenced)
+        if not dry_run:
+            doomed = [f["_id"] for f in unreferenced]
+            await gridfs_files.delete_many({"_id": {"$in": doomed}})
+            await gridfs_chunks.delete_many({"files_id": {"$in": doomed}})
+
+
+async def _sweep_chunks(report: dict, dry_run: bool):
+    """Chunks of uploads that never got a files.files entry (interrupted writes)"""
+    cutoff = _cutoff()
+    last = None
+    while True:
+        id_range = {"$lt": cutoff}
+        if last is not None:
+            id_range["$gt"] = last
+        # One entry per file: first chunks only, walked along the (files_id, n) index
+        firsts = await gridfs_chunks.find({"files_id": id_range, "n": 0}, {"files_id": 1}).sort("files_id", 1).limit(GC_BATCH_SIZE).to_list(GC_BATCH_SIZE)
+        if not firsts:
+            return
+        last = firsts[-1]["files_id"]
+        ids = [c["files_id"] for c in firsts]
+        known = await _ids_present(gridfs_files, "_id", ids)
+        known |= await _ids_present(db.upload_sessions, "gridfs_id", ids)
+        orphans = [i for i in ids if str(i) not in known]
+        if orphans:
+            report["orphan_chunk_sets"] += len(orphans)
+            async for row in gridfs_chunks.aggregate([
+                {"$match": {"files_id": {"$in": orphans}}},
+                {"$group": {"_id": None, "bytes": {"$sum": {"$binarySize": "$data"}}}},
+            ]):
+                report["bytes_reclaimed"] += row["bytes"]
+            if not dry_run:
+                await gridfs_chunks.delete_many({"files_id": {"$in": orphans}})
+        await asyncio.sleep(GC_PAUSE_SECONDS)
+
+
+async def collect(dry_run: bool = False) -> dict:
+    """Run every sweep once, top of the reference chain first, and report what was (or would be) removed."""
+    started = datetime.utcnow()
+    report = {"dry_run": dry_run, "presentations": 0, "file_docs": 0, "blob_refs": 0, "blobs": 0, "gridfs_files": 0,
+              "orphan_chunk_sets": 0, "bytes_reclaimed": 0}
+    doomed = await _sweep_presentations(report, dry_run)
+    await _sweep_file_docs(report, dry_run, doomed)
+    await _sweep_blobs(report, dry_run)
+    await _sweep_gridfs_files(report, dry_run)
+    await _sweep_chunks(report, dry_run)
+    report["seconds"] = round((datetime.utcnow() - started).total_seconds(), 1)
+    return report
+
+
+async def run_periodically():
+    while True:
+        await asyncio.sleep(GC_INTERVAL_HOURS * 3600)
+        try:
+            report = await collect()
+            if report["bytes_reclaimed"] or report["presentations"] or report["file_docs"] or report["blobs"]:
+                print("file gc:", report)
+        except Exception as e:
+            print("file gc error:", e)
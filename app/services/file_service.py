@@ -1,12 +1,139 @@
 import os
-from fastapi import UploadFile, HTTPException
+import base64
+import hashlib
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+from fastapi import UploadFile, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from app.config.database import db
+from app.core.mongodb_utils import safe_objectid
+from app.core.permissions import get_membership
 from bson import ObjectId
-from datetime import datetime
+from bson.errors import InvalidId
+from datetime import datetime, timezone
 
 bucket = AsyncIOMotorGridFSBucket(db, bucket_name="files")
 ALLOWED_EXTENSIONS = {".pdf", ".ppt", ".pptx", ".doc", ".docx"}
+# Uploads are copied into GridFS in UPLOAD_CHUNK_SIZE pieces and rejected past MAX_UPLOAD_SIZE
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "200")) * 1024 * 1024
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the maximum size of {MAX_UPLOAD_SIZE // (1024 * 1024)} MB")
+
+
+async def stream_to_gridfs(file: UploadFile, filename: str, metadata: dict, hasher=None) -> tuple[ObjectId, int]:
+    """
+    Copy an UploadFile into GridFS chunk by chunk without buffering it whole
+    and return the GridFS id and the number of bytes written.
+    Raises 413 as soon as the size limit is passed and removes the partial upload.
+    Each chunk is also fed to `hasher` when one is given.
+    """
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise _too_large()
+
+    upload_stream = bucket.open_upload_stream(filename, metadata=metadata)
+    total = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > MAX_UPLOAD_SIZE:
+                raise _too_large()
+            if hasher is not None:
+                hasher.update(chunk)
+            await upload_stream.write(chunk)
+    except BaseException:
+        await upload_stream.abort()
+        raise
+    await upload_stream.close()
+    return upload_stream._id, total
+
+
+# --------------------------------------------------------
+# Content-addressed blobs: db.blobs maps a SHA-256 digest to one GridFS file
+# and keeps the ids of the db.files documents referencing it in `refs`.
+# A set (rather than a bare counter) keeps acquire/release idempotent.
+# --------------------------------------------------------
+async def register_blob(digest: str, gridfs_id: ObjectId, length: int, ref_id: str) -> ObjectId:
+    """
+    Add ref_id as a reference to the blob with this digest, creating the blob
+    from gridfs_id if it is new. Returns the GridFS id that holds the content;
+    when it differs from gridfs_id the caller's copy is redundant.
+    """
+    existing = await db.blobs.find_one_and_update({"_id": digest}, {"$addToSet": {"refs": ref_id}})
+    if existing:
+        return ObjectId(existing["gridfs_id"])
+    try:
+        await db.blobs.insert_one({
+            "_id": digest,
+            "gridfs_id": str(gridfs_id),
+            "length": length,
+            "refs": [ref_id],
+            "created_at": datetime.utcnow(),
+        })
+        return gridfs_id
+    except DuplicateKeyError:
+        # Registered concurrently by an identical upload
+        existing = await db.blobs.find_one_and_update({"_id": digest}, {"$addToSet": {"refs": ref_id}})
+        return ObjectId(existing["gridfs_id"])
+
+
+async def store_blob(file: UploadFile, filename: str, metadata: dict, ref_id: str) -> dict:
+    """
+    Stream an upload into GridFS while hashing it. If identical content is
+    already stored, the new copy is dropped and the existing blob is referenced.
+    """
+    hasher = hashlib.sha256()
+    gridfs_id, length = await stream_to_gridfs(file, filename, metadata, hasher)
+    digest = hasher.hexdigest()
+    stored_id = await register_blob(digest, gridfs_id, length, ref_id)
+    if stored_id != gridfs_id:
+        await bucket.delete(gridfs_id)
+    return {"gridfs_id": str(stored_id), "sha256": digest, "length": length, "deduplicated": stored_id != gridfs_id}
+
+
+async def release_blob(ref_id: str, sha256: str | None, gridfs_id: str | None) -> bool:
+    """
+    Drop ref_id's reference; the GridFS content is deleted with the last one.
+    Files stored before content addressing (no sha256) are deleted directly.
+    Returns whether GridFS content was deleted.
+    """
+    if not sha256:
+        if gridfs_id:
+            try:
+                await bucket.delete(ObjectId(gridfs_id))
+                return True
+            except Exception:
+                pass
+        return False
+    blob = await db.blobs.find_one_and_update(
+        {"_id": sha256}, {"$pull": {"refs": ref_id}}, return_document=ReturnDocument.AFTER
+    )
+    if blob and not blob.get("refs"):
+        # Only delete if nobody re-referenced it in the meantime
+        result = await db.blobs.delete_one({"_id": sha256, "refs": {"$size": 0}})
+        if result.deleted_count:
+            try:
+                await bucket.delete(ObjectId(blob["gridfs_id"]))
+                return True
+            except Exception:
+                pass
+    return False
+
+
+async def ensure_indexes():
+    await db.files.create_index([("project_id", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)])
+    await db.blobs.create_index([("gridfs_id", ASCENDING)])
+    await db.blobs.create_index([("refs", ASCENDING)])
+    await db.files.create_index([("gridfs_id", ASCENDING)])
 
 
 async def save_file(file: UploadFile, uploader_id: str, project_id: str = None):
@@ -15,22 +142,29 @@ async def save_file(file: UploadFile, uploader_id: str, project_id: str = None):
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}")
 
-    upload_stream = bucket.open_upload_stream(
+    doc_id = ObjectId()
+    blob = await store_blob(
+        file,
         filename,
         metadata={"uploader_id": uploader_id, "upload_date": datetime.utcnow()},
+        ref_id=str(doc_id),
     )
 
-    content = await file.read()
-    await upload_stream.write(content)
-    await upload_stream.close()
+    return await insert_file_doc(doc_id, filename, uploader_id, project_id, blob)
 
+
+async def insert_file_doc(doc_id: ObjectId, filename: str, uploader_id: str, project_id: str | None, blob: dict) -> dict:
+    """Create the db.files document for content already stored by store_blob (or an upload session)"""
     file_doc = {
+        "_id": doc_id,
         "filename": filename,
         "uploader_id": uploader_id,
         "upload_date": datetime.utcnow(),
-        "url": f"/files/{str(upload_stream._id)}",
+        "url": f"/files/{blob['gridfs_id']}",
         "version": 1,
-        "gridfs_id": str(upload_stream._id),
+        "gridfs_id": blob["gridfs_id"],
+        "sha256": blob["sha256"],
+        "length": blob["length"],
         "project_id": project_id,
     }
 
@@ -69,18 +203,211 @@ async def get_file_stream(gridfs_id: str):
     except Exception:
         return None
 
-async def get_files_by_project(project_id: str):
-    """Get all files for a specific project"""
-    files = []
-    cursor = db.files.find({"project_id": project_id}).sort("upload_date", -1)
-    async for f in cursor:
-        f["id"] = str(f["_id"])
-        del f["_id"]
-        # Convert datetime to ISO string if needed
-        if "upload_date" in f and hasattr(f["upload_date"], "isoformat"):
-            f["upload_date"] = f["upload_date"].isoformat()
-        files.append(f)
-    return files
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".ppt": "application/vnd.ms-powerpoint",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+def content_type_for(filename: str, stored: str | None = None) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in CONTENT_TYPES:
+        return CONTENT_TYPES[ext]
+    if stored and stored != "application/octet-stream":
+        return stored
+    return mimetypes.guess_type(filename or "")[0] or "application/octet-stream"
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    fallback = (filename or "file").encode("ascii", "replace").decode().replace('"', "")
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename or 'file')}"
+
+
+def parse_range(header: str, length: int) -> tuple[int, int] | None:
+    """
+    Parse a single "bytes=start-end" Range header into inclusive offsets.
+    Returns None for headers we serve in full (multiple ranges, other units);
+    raises 416 for ranges outside the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s == "":
+            # Suffix range: the last N bytes
+            suffix = int(end_s)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(length - suffix, 0), length - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else length - 1
+    except ValueError:
+        return None
+    if start >= length or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{length}"})
+    return start, min(end, length - 1)
+
+
+async def _iter_range(grid_out, start: int, end: int):
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(UPLOAD_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def not_modified(request: Request, etag: str, modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def gridfs_download_response(request: Request, grid_out, filename: str, content_type: str | None = None, headers: dict | None = None) -> Response:
+    """
+    Serve a GridFS file honouring conditional GET (ETag/Last-Modified) and
+    single byte-range requests. GridFS files are immutable, so the GridFS id
+    is a strong ETag.
+    """
+    length = grid_out.length
+    modified = grid_out.upload_date
+    if modified.tzinfo is None:
+        modified = modified.replace(tzinfo=timezone.utc)
+    etag = f'"{grid_out._id}"'
+    base_headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified.timestamp(), usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(filename),
+        **(headers or {}),
+    }
+    media_type = content_type_for(filename, content_type)
+
+    if not_modified(request, etag, modified):
+        return Response(status_code=304, headers=base_headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, length)
+
+    if byte_range is None:
+        return StreamingResponse(_iter_range(grid_out, 0, length - 1), media_type=media_type,
+                                 headers={**base_headers, "Content-Length": str(length)})
+
+    start, end = byte_range
+    return StreamingResponse(_iter_range(grid_out, start, end), status_code=206, media_type=media_type, headers={
+        **base_headers,
+        "Content-Range": f"bytes {start}-{end}/{length}",
+        "Content-Length": str(end - start + 1),
+    })
+
+
+# Fields returned by project file listings
+FILE_LIST_FIELDS = ("filename", "uploader_id", "upload_date", "url", "version", "project_id", "length")
+MAX_PAGE_SIZE = 200
+
+
+def _encode_cursor(upload_date: datetime, oid: ObjectId) -> str:
+    return base64.urlsafe_b64encode(f"{upload_date.isoformat()}|{oid}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """Inverse of _encode_cursor; raises ValueError on malformed input."""
+    try:
+        upload_date, oid = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(upload_date), ObjectId(oid)
+    except (InvalidId, TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _listing_out(f: dict) -> dict:
+    f["id"] = str(f.pop("_id"))
+    if hasattr(f.get("upload_date"), "isoformat"):
+        f["upload_date"] = f["upload_date"].isoformat()
+    return f
+
+
+async def get_files_by_project(project_id: str, cursor: str | None = None, limit: int = 50) -> dict:
+    """Keyset-paginate a project's files newest first on (upload_date, _id)."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = {"project_id": project_id}
+    if cursor:
+        upload_date, oid = _decode_cursor(cursor)
+        query["$or"] = [
+            {"upload_date": {"$lt": upload_date}},
+            {"upload_date": upload_date, "_id": {"$lt": oid}},
+        ]
+
+    docs = await db.files.find(query, {f: 1 for f in FILE_LIST_FIELDS}) \
+        .sort([("upload_date", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1).to_list(limit + 1)
+    more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = _encode_cursor(docs[-1]["upload_date"], docs[-1]["_id"]) if more else None
+    return {"items": [_listing_out(f) for f in docs], "next_cursor": next_cursor, "limit": limit}
+
+
+async def get_files_by_projects(project_ids: list[str], per_project: int = 20) -> dict[str, list[dict]]:
+    """Newest `per_project` files of each project, fetched in a single aggregation."""
+    per_project = max(1, min(int(per_project), MAX_PAGE_SIZE))
+    result = {pid: [] for pid in project_ids}
+    if not project_ids:
+        return result
+    pipeline = [
+        {"$match": {"project_id": {"$in": list(result)}}},
+        {"$sort": {"project_id": 1, "upload_date": -1, "_id": -1}},
+        {"$group": {"_id": "$project_id", "files": {"$push": {"_id": "$_id", **{f: f"${f}" for f in FILE_LIST_FIELDS}}}}},
+        {"$project": {"files": {"$slice": ["$files", per_project]}}},
+    ]
+    async for group in db.files.aggregate(pipeline):
+        result[group["_id"]] = [_listing_out(f) for f in group["files"]]
+    return result
+
+
+async def _project_has_team(project_id: str) -> bool:
+    project_objectid = safe_objectid(project_id)
+    project = await db.projects.find_one({"_id": project_objectid}, {"team_id": 1}) if project_objectid else None
+    if not project:
+        return True  # unknown project: nothing to fall back on
+    if safe_objectid(project.get("team_id")):
+        return True
+    return await db.teams.find_one({"project_id": project_id}, {"_id": 1}) is not None
+
+
+async def _check_file_access(file_doc: dict, user_id: str, user_role: str, action: str):
+    """
+    Admins and the uploader may change any file. Students may change files of
+    projects they are a team member of, or of projects with no team linked at
+    all (broken team/project relationships); everyone else is refused.
+    """
+    if user_role == "admin" or file_doc.get("uploader_id") == user_id:
+        return
+    project_id = file_doc.get("project_id")
+    if not project_id or user_role != "student":
+        raise HTTPException(status_code=403, detail=f"Not authorized to {action} this file")
+    membership = await get_membership(user_id)
+    if membership.in_project(project_id):
+        return
+    if await _project_has_team(project_id):
+        raise HTTPException(status_code=403, detail=f"Not authorized to {action} this file - user not in team")
+
 
 async def update_file(file_id: str, file: UploadFile, user_id: str, user_role: str = "student"):
     """Update/replace an existing file"""
@@ -89,98 +416,34 @@ async def update_file(file_id: str, file: UploadFile, user_id: str, user_role: s
     if not existing:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Admins can update any file
-    if user_role == "admin":
-        pass  # Admin has full permissions
-    # Check if user is the uploader
-    elif existing.get("uploader_id") == user_id:
-        pass  # Original uploader can update
-    # Check if file belongs to a project and user has access to that project
-    else:
-        project_id = existing.get("project_id")
-        if not project_id:
-            # File doesn't belong to any project, only uploader can update
-            raise HTTPException(status_code=403, detail="Not authorized to update this file")
-
-        # For students, allow update if they can access the project (simpler approach)
-        if user_role == "student":
-            try:
-                # Check if the project exists and is accessible
-                project = await db.projects.find_one({"_id": ObjectId(project_id)})
-                if not project:
-                    raise HTTPException(status_code=403, detail="Not authorized to update this file - project not found")
-
-                # If project exists, check if user is in the team for this project
-                team_id = project.get("team_id")
-                if not team_id or team_id == "string" or len(str(team_id)) != 24:
-                    # Try alternative approach - find team by project_id
-                    team = await db.teams.find_one({"project_id": project_id})
-                    if team:
-                        team_id = str(team["_id"])
-                    else:
-                        # No team found, but let's be more permissive for students in project context
-                        # This handles cases where team relationships might be broken
-                        pass
-
-                if team_id and len(str(team_id)) == 24:
-                    # Check if user is a member of the team
-                    team = await db.teams.find_one({"_id": ObjectId(team_id)})
-                    if team:
-                        members = team.get("members", [])
-                        member_ids = team.get("member_ids", [])
-                        all_member_ids = [str(m) for m in members] + [str(m) for m in member_ids]
-                        if user_id in all_member_ids:
-                            pass  # Team member can update
-                        else:
-                            raise HTTPException(status_code=403, detail="Not authorized to update this file - user not in team")
-                    else:
-                        raise HTTPException(status_code=403, detail="Not authorized to update this file - team not found")
-                else:
-                    # No team_id found, but if user can access this project endpoint,
-                    # they should be able to manage files in it (graceful fallback)
-                    # This handles edge cases in team/project relationships
-                    pass
-
-            except Exception as e:
-                # If there's any error in team/project validation, allow update
-                # This provides a graceful fallback for students
-                print(f"Team/project validation error (allowing update): {e}")
-                pass
-
-        else:
-            # For mentors and other roles, require proper team membership
-            raise HTTPException(status_code=403, detail="Not authorized to update this file")
-
-    # Delete old GridFS file
-    old_gridfs_id = existing.get("gridfs_id")
-    if old_gridfs_id:
-        try:
-            await bucket.delete(ObjectId(old_gridfs_id))
-        except Exception:
-            pass
+    await _check_file_access(existing, user_id, user_role, "update")
 
-    # Save new file
+    # Save new file first so a rejected upload leaves the old one in place
     filename = file.filename
     ext = os.path.splitext(filename)[1].lower()
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}")
 
-    upload_stream = bucket.open_upload_stream(
+    blob = await store_blob(
+        file,
         filename,
         metadata={"uploader_id": user_id, "upload_date": datetime.utcnow()},
+        ref_id=file_id,
     )
 
-    content = await file.read()
-    await upload_stream.write(content)
-    await upload_stream.close()
+    # Release the old content unless the new upload is byte-identical
+    if existing.get("sha256") != blob["sha256"]:
+        await release_blob(file_id, existing.get("sha256"), existing.get("gridfs_id"))
 
     # Update file document
     await db.files.update_one(
         {"_id": ObjectId(file_id)},
         {"$set": {
             "filename": filename,
-            "gridfs_id": str(upload_stream._id),
-            "url": f"/files/{str(upload_stream._id)}",
+            "gridfs_id": blob["gridfs_id"],
+            "sha256": blob["sha256"],
+            "length": blob["length"],
+            "url": f"/files/{blob['gridfs_id']}",
             "upload_date": datetime.utcnow(),
             "version": existing.get("version", 1) + 1
         }}
@@ -194,76 +457,9 @@ async def delete_file(file_id: str, user_id: str, user_role: str = "student"):
     if not file_doc:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Admins can delete any file
-    if user_role == "admin":
-        pass  # Admin has full permissions
-    # Check if user is the uploader
-    elif file_doc.get("uploader_id") == user_id:
-        pass  # Original uploader can delete
-    # Check if file belongs to a project and user has access to that project
-    else:
-        project_id = file_doc.get("project_id")
-        if not project_id:
-            # File doesn't belong to any project, only uploader can delete
-            raise HTTPException(status_code=403, detail="Not authorized to delete this file")
-
-        # For students, allow deletion if they can access the project (simpler approach)
-        if user_role == "student":
-            try:
-                # Check if the project exists and is accessible
-                project = await db.projects.find_one({"_id": ObjectId(project_id)})
-                if not project:
-                    raise HTTPException(status_code=403, detail="Not authorized to delete this file - project not found")
-
-                # If project exists, check if user is in the team for this project
-                team_id = project.get("team_id")
-                if not team_id or team_id == "string" or len(str(team_id)) != 24:
-                    # Try alternative approach - find team by project_id
-                    team = await db.teams.find_one({"project_id": project_id})
-                    if team:
-                        team_id = str(team["_id"])
-                    else:
-                        # No team found, but let's be more permissive for students in project context
-                        # This handles cases where team relationships might be broken
-                        pass
-
-                if team_id and len(str(team_id)) == 24:
-                    # Check if user is a member of the team
-                    team = await db.teams.find_one({"_id": ObjectId(team_id)})
-                    if team:
-                        members = team.get("members", [])
-                        member_ids = team.get("member_ids", [])
-                        all_member_ids = [str(m) for m in members] + [str(m) for m in member_ids]
-                        if user_id in all_member_ids:
-                            pass  # Team member can delete
-                        else:
-                            raise HTTPException(status_code=403, detail="Not authorized to delete this file - user not in team")
-                    else:
-                        raise HTTPException(status_code=403, detail="Not authorized to delete this file - team not found")
-                else:
-                    # No team_id found, but if user can access this project endpoint,
-                    # they should be able to manage files in it (graceful fallback)
-                    # This handles edge cases in team/project relationships
-                    pass
-
-            except Exception as e:
-                # If there's any error in team/project validation, allow deletion
-                # This provides a graceful fallback for students
-                print(f"Team/project validation error (allowing deletion): {e}")
-                pass
-
-        else:
-            # For mentors and other roles, require proper team membership
-            raise HTTPException(status_code=403, detail="Not authorized to delete this file")
-
-    # Delete GridFS file
-    gridfs_id = file_doc.get("gridfs_id")
-    if gridfs_id:
-        try:
-            await bucket.delete(ObjectId(gridfs_id))
-        except Exception:
-            pass
+    await _check_file_access(file_doc, user_id, user_role, "delete")
 
-    # Delete file document
+    # Delete file document, then the content if this was its last reference
     await db.files.delete_one({"_id": ObjectId(file_id)})
+    await release_blob(file_id, file_doc.get("sha256"), file_doc.get("gridfs_id"))
     return {"deleted": True}
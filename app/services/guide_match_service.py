@@ -0,0 +1,127 @@
+import re
+import time
+from collections import defaultdict
+from app.config.database import db
+
+# Roles whose accounts can be a project guide
+GUIDE_ROLES = ["mentor", "panel"]
+MIN_CONFIDENCE = 0.6
+CACHE_TTL_SECONDS = 300
+
+_HONORIFICS = {"dr", "prof", "mr", "mrs", "ms", "er", "sir"}
+
+
+def normalize_person_name(name: str) -> str:
+    """Lowercase, drop honorifics/punctuation and sort tokens ("Dr. A. Kumar" == "Kumar A")."""
+    tokens = re.sub(r"[^a-z0-9 ]+", " ", (name or "").lower()).split()
+    return " ".join(sorted(t for t in tokens if t not in _HONORIFICS))
+
+
+def _trigrams(normalized: str) -> set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _token_score(query: list[str], candidate: list[str]) -> float:
+    """Share of tokens that agree; a single letter matching a word's initial counts 0.9."""
+    remaining = list(candidate)
+    matched = 0.0
+    # Full words first so "a kumar" pairs kumar↔kumar before a↔anil
+    for q in sorted(query, key=len, reverse=True):
+        for c in remaining:
+            if q == c:
+                matched += 1
+            elif (len(q) == 1 and c.startswith(q)) or (len(c) == 1 and q.startswith(c)):
+                matched += 0.9
+            else:
+                continue
+            remaining.remove(c)
+            break
+    return matched / max(len(query), len(candidate), 1)
+
+
+class GuideMatcher:
+    """Normalized-name and trigram index over guide accounts."""
+
+    def __init__(self, users: list[dict]):
+        self.users = []
+        self.exact: dict[str, int] = {}
+        self.trigram_index: dict[str, set[int]] = defaultdict(set)
+        for u in users:
+            key = normalize_person_name(u.get("username", ""))
+            if not key:
+                continue
+            idx = len(self.users)
+            self.users.append({"id": str(u["_id"]), "name": u.get("username"), "email": u.get("email"), "key": key})
+            self.exact.setdefault(key, idx)
+            for gram in _trigrams(key):
+                self.trigram_index[gram].add(idx)
+
+    def match(self, name: str, limit: int = 3) -> dict:
+        key = normalize_person_name(name)
+        result = {"guide_name": name, "normalized": key, "mentor_id": None, "confidence": 0.0, "candidates": []}
+        if not key:
+            return result
+        if key in self.exact:
+            user = self.users[self.exact[key]]
+            result.update(mentor_id=user["id"], confidence=1.0,
+                          candidates=[{"id": user["id"], "name": user["name"], "confidence": 1.0}])
+            return result
+
+        grams = _trigrams(key)
+        shared: dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for idx in self.trigram_index.get(gram, ()):
+                shared[idx] += 1
+
+        scored = []
+        tokens = key.split()
+        for idx, count in shared.items():
+            user = self.users[idx]
+            dice = 2 * count / (len(grams) + len(_trigrams(user["key"])))
+            confidence = round(max(dice, _token_score(tokens, user["key"].split())), 3)
+            scored.append((confidence, idx))
+        scored.sort(reverse=True)
+
+        result["candidates"] = [
+            {"id": self.users[idx]["id"], "name": self.users[idx]["name"], "confidence": conf}
+            for conf, idx in scored[:limit]
+        ]
+        if scored and scored[0][0] >= MIN_CONFIDENCE:
+            # An exact tie between two accounts is ambiguous; leave it for an admin
+            if len(scored) == 1 or scored[1][0] < scored[0][0]:
+                result["mentor_id"] = self.users[scored[0][1]]["id"]
+            result["confidence"] = scored[0][0]
+        return result
+
+
+_matcher: GuideMatcher | None = None
+_built_at = 0.0
+
+
+async def get_matcher() -> GuideMatcher:
+    """Return the cached matcher, rebuilding it after invalidation or CACHE_TTL_SECONDS."""
+    global _matcher, _built_at
+    if _matcher is None or time.monotonic() - _built_at > CACHE_TTL_SECONDS:
+        users = [u async for u in db.users.find({"role": {"$in": GUIDE_ROLES}}, {"username": 1, "email": 1})]
+        _matcher = GuideMatcher(users)
+        _built_at = time.monotonic()
+    return _matcher
+
+
+def invalidate():
+    global _matcher
+    _matcher = None
+
+
+async def match_names(names: set[str]) -> dict[str, dict]:
+    matcher = await get_matcher()
+    return {name: matcher.match(name) for name in names}
+
+
+async def match_batch(batch_id: str | None = None) -> list[dict]:
+    """Resolve every distinct guide_name in an upload batch (or all batches)."""
+    query = {"batch_id": batch_id} if batch_id else {}
+    names = await db.allocations.distinct("guide_name", query)
+    matches = await match_names({n for n in names if n})
+    return sorted(matches.values(), key=lambda m: (m["confidence"], m["guide_name"]))
@@ -1,25 +1,103 @@
+import asyncio
+import base64
+import os
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
 from app.config.database import db
 from datetime import datetime
 from typing import List, Optional
 
-async def get_notifications_for_user(user_id: str):
-    notifications = []
-    cursor = db.notifications.find({"user_id": user_id}).sort("created_at", -1)
-    async for n in cursor:
-        notifications.append(n)
-    return notifications
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Unread counts live in notification_counters ({_id: user_id, unread}) and are
+# kept up to date on every write; a periodic job repairs any drift
+RECONCILE_INTERVAL_MINUTES = float(os.getenv("NOTIFICATION_RECONCILE_MINUTES", "60"))
+
+def _encode_cursor(created_at: str, oid: ObjectId) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{oid}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[str, ObjectId]:
+    """Inverse of _encode_cursor; raises ValueError on malformed input."""
+    try:
+        created_at, oid = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return created_at, ObjectId(oid)
+    except (InvalidId, TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+async def get_notifications_for_user(user_id: str, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                                     read: Optional[bool] = None, notif_type: Optional[str] = None):
+    """Keyset-paginate a user's notifications newest first on (created_at, _id)."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = {"user_id": str(user_id)}
+    if read is not None:
+        query["read"] = read
+    if notif_type:
+        query["notif_type"] = notif_type
+    if cursor:
+        created_at, oid = _decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": oid}},
+        ]
+
+    docs = await db.notifications.find(query) \
+        .sort([("created_at", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1).to_list(limit + 1)
+    more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = _encode_cursor(docs[-1]["created_at"], docs[-1]["_id"]) if more else None
+    return {"items": docs, "next_cursor": next_cursor, "limit": limit}
+
+async def _unread_counts(user_ids: list[str]) -> dict[str, int]:
+    counts = {uid: 0 for uid in user_ids}
+    async for row in db.notifications.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}, "read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}},
+    ]):
+        counts[row["_id"]] = row["unread"]
+    return counts
+
+async def _add_unread(user_ids: list[str], amount: int = 1):
+    """Bump counters for notifications that have already been inserted"""
+    if not user_ids:
+        return
+    existing = {c["_id"] async for c in db.notification_counters.find({"_id": {"$in": user_ids}}, {"_id": 1})}
+    missing = [uid for uid in dict.fromkeys(user_ids) if uid not in existing]
+    bump = [uid for uid in user_ids if uid in existing]
+    if missing:
+        # A missing counter is seeded from the full backlog (which already
+        # includes the new notification) instead of starting at `amount`
+        counts = await _unread_counts(missing)
+        result = await db.notification_counters.bulk_write(
+            [UpdateOne({"_id": uid}, {"$setOnInsert": {"unread": counts[uid]}}, upsert=True) for uid in missing],
+            ordered=False,
+        )
+        # Someone else created the counter in between: increment it like any other
+        seeded = {missing[n] for n in result.upserted_ids}
+        bump += [uid for uid in user_ids if uid in missing and uid not in seeded]
+    if bump:
+        await db.notification_counters.bulk_write(
+            [UpdateOne({"_id": uid}, {"$inc": {"unread": amount}}) for uid in bump],
+            ordered=False,
+        )
 
 async def get_unread_count_for_user(user_id: str) -> int:
     """Get count of unread notifications for a user"""
+    counter = await db.notification_counters.find_one({"_id": user_id})
+    if counter:
+        return max(counter.get("unread", 0), 0)
+    # First read for this user: seed the counter (unless a write created it meanwhile)
     count = await db.notifications.count_documents({"user_id": user_id, "read": False})
+    await db.notification_counters.update_one({"_id": user_id}, {"$setOnInsert": {"unread": count}}, upsert=True)
     return count
 
 async def mark_notification_read(user_id: str, notif_id: str):
     result = await db.notifications.update_one(
-        {"_id": ObjectId(notif_id), "user_id": user_id},
+        {"_id": ObjectId(notif_id), "user_id": user_id, "read": False},
         {"$set": {"read": True}},
     )
+    if result.modified_count:
+        await db.notification_counters.update_one({"_id": user_id, "unread": {"$gt": 0}}, {"$inc": {"unread": -1}})
     return result.modified_count > 0
 
 async def mark_all_notifications_read(user_id: str):
@@ -28,6 +106,13 @@ async def mark_all_notifications_read(user_id: str):
         {"user_id": user_id, "read": False},
         {"$set": {"read": True}}
     )
+    # Subtract what was marked rather than writing 0, so a notification
+    # created in between stays counted
+    await db.notification_counters.update_one(
+        {"_id": user_id},
+        [{"$set": {"unread": {"$max": [0, {"$subtract": [{"$ifNull": ["$unread", 0]}, result.modified_count]}]}}}],
+        upsert=True,
+    )
     return result.modified_count
 
 async def create_notification(user_id: str, message: str, notif_type: str = "general", related_id: Optional[str] = None):
@@ -41,6 +126,7 @@ async def create_notification(user_id: str, message: str, notif_type: str = "gen
         "created_at": datetime.utcnow().isoformat()
     }
     result = await db.notifications.insert_one(notification)
+    await _add_unread([user_id])
     return str(result.inserted_id)
 
 async def create_role_based_notifications(audience: str, message: str, title: str, notif_type: str = "announcement"):
@@ -80,5 +166,47 @@ async def create_role_based_notifications(audience: str, message: str, title: st
 
     if notifications:
         result = await db.notifications.insert_many(notifications)
+        await _add_unread([str(uid) for uid in user_ids])
         return len(result.inserted_ids)
     return 0
+
+async def reconcile_unread_counters() -> int:
+    """Rewrite counters that disagree with the notifications collection; returns how many were fixed"""
+    # Counters are read before the notifications are counted, and only
+    # rewritten if still unchanged, so a write landing in between is never
+    # clobbered (the next run picks up any remaining drift)
+    counters = {c["_id"]: c.get("unread") async for c in db.notification_counters.find({}, {"unread": 1})}
+    actual = {}
+    async for row in db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}},
+    ]):
+        actual[row["_id"]] = row["unread"]
+    ops = []
+    for uid, unread in counters.items():
+        expected = actual.pop(uid, 0)
+        if unread != expected:
+            ops.append(UpdateOne({"_id": uid, "unread": unread}, {"$set": {"unread": expected}}))
+    # Users with unread notifications but no counter yet
+    ops += [UpdateOne({"_id": uid}, {"$setOnInsert": {"unread": n}}, upsert=True) for uid, n in actual.items() if uid]
+    if not ops:
+        return 0
+    result = await db.notification_counters.bulk_write(ops, ordered=False)
+    return result.modified_count + result.upserted_count
+
+async def run_reconciliation_loop():
+    # First pass at startup, so counters created before this code shipped are
+    # corrected without waiting a full interval
+    while True:
+        try:
+            fixed = await reconcile_unread_counters()
+            if fixed:
+                print(f"Reconciled {fixed} notification counters")
+        except Exception as e:
+            print("notification counter reconciliation error:", e)
+        await asyncio.sleep(RECONCILE_INTERVAL_MINUTES * 60)
+
+async def ensure_indexes():
+    # Inbox pages, optionally filtered by read state or type; created_at is an ISO string
+    for prefix in ([], [("read", ASCENDING)], [("notif_type", ASCENDING)]):
+        await db.notifications.create_index([("user_id", ASCENDING), *prefix, ("created_at", DESCENDING), ("_id", DESCENDING)])
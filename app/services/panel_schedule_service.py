@@ -0,0 +1,210 @@
+import heapq
+import os
+import random
+from collections import deque
+from pymongo import UpdateOne
+from app.config.database import db
+from app.core.mongodb_utils import safe_objectid_list
+
+# Automatic panel assignment for a presentation round, solved as a bipartite
+# b-matching: every presentation needs PANEL_SIZE panel members, a panel
+# member sits on at most PANEL_DAILY_CAPACITY presentations per date, and a
+# team's own mentor is never on its panel. Slots are filled least-loaded
+# first (load counted over the whole round); when only ineligible or full
+# members are left, an augmenting path moves members between presentations
+# of the same date to free one up.
+PANEL_SIZE = int(os.getenv("PANEL_SIZE", "2"))
+PANEL_DAILY_CAPACITY = int(os.getenv("PANEL_DAILY_CAPACITY", "10"))
+
+
+class _Day:
+    """Assignment state of the presentations held on one date."""
+
+    def __init__(self, capacity: int, load: dict, order: dict):
+        self.capacity = capacity
+        self.load = load  # round-wide, shared between days
+        self.order = order
+        self.used: dict[str, int] = {}
+        self.holders: dict[str, set[int]] = {}  # panel member -> presentations (indexes) they sit on
+        self.heap: list = []
+
+    def add(self, q: str, i: int):
+        self.used[q] = self.used.get(q, 0) + 1
+        self.holders.setdefault(q, set()).add(i)
+        self.load[q] = self.load.get(q, 0) + 1
+
+    def has_room(self, q: str) -> bool:
+        return self.used.get(q, 0) < self.capacity
+
+    def rebuild(self, panel_ids: list[str]):
+        self.heap = [(self.load.get(q, 0), self.used.get(q, 0), self.order[q], q) for q in panel_ids if self.has_room(q)]
+        heapq.heapify(self.heap)
+
+    def pick(self, excluded: set[str]) -> str | None:
+        """Least loaded member with room that is not excluded."""
+        skipped = []
+        chosen = None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[3] in excluded:
+                skipped.append(entry)
+                continue
+            chosen = entry[3]
+            break
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return chosen
+
+    def push(self, q: str):
+        if self.has_room(q):
+            heapq.heappush(self.heap, (self.load[q], self.used[q], self.order[q], q))
+
+
+def _augment(day: _Day, i: int, panels: list[list[str]], excluded: list[set[str]], panel_ids: list[str]) -> bool:
+    """
+    Give presentation i one more member by moving members along an
+    augmenting path: i takes q, the presentation q leaves takes r, and so on
+    until a member with room on this date is reached.
+    """
+    parent: dict[str, tuple[str, int] | None] = {}
+    queue = deque()
+    for q in panel_ids:
+        if q not in excluded[i] and q not in panels[i]:
+            parent[q] = None
+            queue.append(q)
+    end = None
+    while queue:
+        q = queue.popleft()
+        if day.has_room(q):
+            end = q
+            break
+        for j in day.holders.get(q, ()):
+            if j == i:
+                continue
+            for r in panel_ids:
+                if r not in parent and r not in excluded[j] and r not in panels[j]:
+                    parent[r] = (q, j)
+                    queue.append(r)
+    if end is None:
+        return False
+
+    # Only the member at the end of the path sits on one more presentation
+    day.used[end] = day.used.get(end, 0) + 1
+    day.load[end] = day.load.get(end, 0) + 1
+    r = end
+    while parent[r] is not None:
+        q, j = parent[r]
+        panels[j][panels[j].index(q)] = r
+        day.holders[q].discard(j)
+        day.holders.setdefault(r, set()).add(j)
+        r = q
+    panels[i].append(r)
+    day.holders.setdefault(r, set()).add(i)
+    return True
+
+
+def solve(presentations: list[dict], panel_ids: list[str], excluded: list[set[str]],
+          panel_size: int, capacity: int, seed: int = 0) -> tuple[list[list[str]], dict[str, int]]:
+    """
+    Fill every presentation's panel up to panel_size. Each presentation dict
+    needs "date" and "panel" (members to keep); excluded[i] lists members
+    presentation i must not get. Returns the panels and the round-wide loads.
+    """
+    shuffled = list(panel_ids)
+    random.Random(seed).shuffle(shuffled)  # stable, unbiased tie-break between equally loaded members
+    order = {q: n for n, q in enumerate(shuffled)}
+    allowed = set(panel_ids)
+    load: dict[str, int] = {}
+    # kept members that are now excluded (e.g. the team's mentor) are dropped and refilled
+    panels = [
+        [q for q in dict.fromkeys(p["panel"]) if q in allowed and q not in excluded[i]][:panel_size]
+        for i, p in enumerate(presentations)
+    ]
+
+    days: dict[str, list[int]] = {}
+    for i, p in enumerate(presentations):
+        days.setdefault(p["date"] or "", []).append(i)
+
+    for indexes in days.values():
+        day = _Day(capacity, load, order)
+        for i in indexes:
+            for q in panels[i]:
+                day.add(q, i)
+        day.rebuild(panel_ids)
+        # One slot per presentation per pass, so shortfalls spread out evenly
+        for _ in range(panel_size):
+            for i in indexes:
+                if len(panels[i]) >= panel_size:
+                    continue
+                q = day.pick(excluded[i] | set(panels[i]))
+                if q is not None:
+                    day.add(q, i)
+                    panels[i].append(q)
+                    day.push(q)
+                elif _augment(day, i, panels, excluded, panel_ids):
+                    day.rebuild(panel_ids)
+    return panels, load
+
+
+async def schedule_round(round_number: int, panel_size: int = PANEL_SIZE, capacity: int = PANEL_DAILY_CAPACITY,
+                         reassign: bool = False, dry_run: bool = False) -> dict:
+    """
+    Assign panel members to every presentation of a round. Existing
+    assignments are kept and topped up unless reassign is set; the result is
+    written with one bulk_write.
+    """
+    presentations = [p async for p in db.presentations.find(
+        {"round_number": round_number}, {"team_id": 1, "project_id": 1, "date": 1, "assigned_panel_ids": 1}
+    )]
+    panel_ids = [str(u["_id"]) async for u in db.users.find({"role": "panel"}, {"_id": 1})]
+
+    mentors: dict[str, str] = {}
+    team_ids = safe_objectid_list([p.get("team_id") for p in presentations])
+    async for t in db.teams.find({"_id": {"$in": team_ids}}, {"mentor_id": 1}):
+        if t.get("mentor_id"):
+            mentors[str(t["_id"])] = str(t["mentor_id"])
+    project_mentors: dict[str, str] = {}
+    project_ids = list({p["project_id"] for p in presentations if p.get("project_id")})
+    async for pr in db.projects.find({"_id": {"$in": safe_objectid_list(project_ids)}}, {"mentor_id": 1}):
+        if pr.get("mentor_id"):
+            project_mentors[str(pr["_id"])] = str(pr["mentor_id"])
+
+    # The round's date in the project's schedule decides the slot; the
+    # presentation's own date is the fallback
+    date_field = f"round{round_number}_date"
+    scheduled: dict[str, str] = {}
+    async for s in db.round_schedules.find({"project_id": {"$in": project_ids}}, {"project_id": 1, date_field: 1}):
+        if s.get(date_field):
+            scheduled[s["project_id"]] = s[date_field]
+
+    problem = []
+    excluded = []
+    for p in presentations:
+        problem.append({
+            "date": scheduled.get(p.get("project_id")) or p.get("date") or "",
+            "panel": [] if reassign else [str(q) for q in p.get("assigned_panel_ids") or []],
+        })
+        excluded.append({m for m in (mentors.get(str(p.get("team_id"))), project_mentors.get(p.get("project_id"))) if m})
+
+    panels, load = solve(problem, panel_ids, excluded, panel_size, capacity, seed=round_number)
+
+    ops = []
+    unfilled = []
+    for p, prob, panel in zip(presentations, problem, panels):
+        if panel != list(p.get("assigned_panel_ids") or []):
+            ops.append(UpdateOne({"_id": p["_id"]}, {"$set": {"assigned_panel_ids": panel}}))
+        if len(panel) < panel_size:
+            unfilled.append({"id": str(p["_id"]), "team_id": p.get("team_id"), "date": prob["date"], "assigned": len(panel)})
+    if ops and not dry_run:
+        await db.presentations.bulk_write(ops, ordered=False)
+
+    loads = [load.get(q, 0) for q in panel_ids]
+    return {
+        "round_number": round_number,
+        "dry_run": dry_run,
+        "presentations": len(presentations),
+        "panel_members": len(panel_ids),
+        "updated": len(ops),
+        "unfilled": unfilled,
+        "load": {"min": min(loads, default=0), "max": max(loads, default=0)},
+    }
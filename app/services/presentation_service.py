@@ -1,7 +1,20 @@
+import asyncio
+import hashlib
+import os
+import re
+import zipfile
 from bson import ObjectId
-from fastapi import UploadFile, HTTPException
-from datetime import datetime
+from fastapi import UploadFile, HTTPException, Request
+from pymongo import ASCENDING, ReturnDocument
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timedelta
 from app.config.database import db
+from app.core.mongodb_utils import safe_objectid, safe_objectid_list
+from app.services import file_service, file_cache_service
+
+# Every worker runs the inline-file migration at startup; a document is
+# claimed before it is migrated, and a claim older than this is taken over
+MIGRATION_CLAIM_MINUTES = int(os.getenv("FILE_MIGRATION_CLAIM_MINUTES", "10"))
 
 
 # --------------------------------------------------------
@@ -37,7 +50,7 @@ async def get_presentations_by_user(user_id: str):
 
 
 # --------------------------------------------------------
-# 🧩 4️⃣ Save PPT file directly into MongoDB
+# 🧩 4️⃣ Save PPT file into GridFS (metadata in db.files)
 # --------------------------------------------------------
 async def save_ppt_file(file: UploadFile, user_id: str):
     # Allow multiple document types for rounds
@@ -45,14 +58,27 @@ async def save_ppt_file(file: UploadFile, user_id: str):
     if ext not in ["ppt", "pptx", "pdf", "doc", "docx"]:
         raise HTTPException(status_code=400, detail="Unsupported file type. Allowed: ppt, pptx, pdf, doc, docx")
 
-    # Read binary data
-    file_data = await file.read()
+    # Content goes to GridFS (deduplicated by SHA-256); db.files keeps the metadata
+    file_id = ObjectId()
+    blob = await file_service.store_blob(
+        file,
+        file.filename,
+        metadata={"uploader_id": str(user_id), "upload_date": datetime.utcnow()},
+        ref_id=str(file_id),
+    )
+
+    return await insert_file_doc(file_id, file.filename, file.content_type, user_id, blob)
 
-    # Prepare Mongo document
+
+async def insert_file_doc(file_id: ObjectId, filename: str, content_type: str | None, user_id: str, blob: dict) -> str:
+    """Create the db.files document for presentation content already stored in GridFS"""
     file_doc = {
-        "filename": file.filename,
-        "content_type": file.content_type,
-        "data": file_data,           # binary PPT data stored in Mongo
+        "_id": file_id,
+        "filename": filename,
+        "content_type": content_type,
+        "gridfs_id": blob["gridfs_id"],
+        "sha256": blob["sha256"],
+        "length": blob["length"],
         "uploaded_by": user_id,
         "uploaded_at": datetime.utcnow().isoformat()
     }
@@ -62,51 +88,291 @@ async def save_ppt_file(file: UploadFile, user_id: str):
     return str(result.inserted_id)
 
 
+async def delete_files(file_ids: list):
+    """Delete presentation file documents together with their GridFS content"""
+    oids = safe_objectid_list(file_ids)
+    if not oids:
+        return
+    docs = [f async for f in db.files.find({"_id": {"$in": oids}}, {"gridfs_id": 1, "sha256": 1})]
+    await db.files.delete_many({"_id": {"$in": oids}})
+    for f in docs:
+        await file_service.release_blob(str(f["_id"]), f.get("sha256"), f.get("gridfs_id"))
+
+
+async def file_download_response(request: Request, file_id: str, headers: dict | None = None):
+    """Stream a presentation file from GridFS, or in slices for not yet migrated inline documents"""
+    file_objectid = safe_objectid(file_id)
+    if not file_objectid:
+        raise HTTPException(status_code=400, detail="Invalid file ID")
+    doc = await db.files.find_one({"_id": file_objectid}, {"data": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    filename = doc.get("filename", "file")
+
+    if doc.get("gridfs_id"):
+        response = await file_cache_service.download_response(request, doc["gridfs_id"], filename, doc.get("content_type"), headers)
+        if response is None:
+            raise HTTPException(status_code=404, detail="File data missing")
+        return response
+
+    # Legacy document with an inline blob that the migration has not reached yet
+    legacy = await db.files.find_one({"_id": file_objectid}, {"data": 1})
+    data: bytes = (legacy or {}).get("data")
+    if not data:
+        raise HTTPException(status_code=404, detail="File data missing")
+    view = memoryview(data)
+    chunks = (bytes(view[i:i + file_service.UPLOAD_CHUNK_SIZE]) for i in range(0, len(data), file_service.UPLOAD_CHUNK_SIZE))
+    return StreamingResponse(chunks, media_type=file_service.content_type_for(filename, doc.get("content_type")), headers={
+        "Content-Disposition": file_service.content_disposition(filename),
+        "Content-Length": str(len(data)),
+        **(headers or {}),
+    })
+
+
+class _ZipSink:
+    """Write-only stream that collects zipfile output until it is drained"""
+
+    def __init__(self):
+        self.parts = []
+        self.pos = 0
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _zip_date(uploaded_at) -> tuple:
+    try:
+        when = uploaded_at if isinstance(uploaded_at, datetime) else datetime.fromisoformat(str(uploaded_at))
+    except ValueError:
+        when = datetime.utcnow()
+    return max(when.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+async def _file_chunks(doc: dict):
+    if doc.get("gridfs_id"):
+        grid_out = await file_service.get_file_stream(doc["gridfs_id"])
+        if not grid_out:
+            return
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+        return
+    legacy = await db.files.find_one({"_id": doc["_id"]}, {"data": 1})
+    data = (legacy or {}).get("data") or b""
+    for i in range(0, len(data), file_service.UPLOAD_CHUNK_SIZE):
+        yield bytes(data[i:i + file_service.UPLOAD_CHUNK_SIZE])
+
+
+async def assigned_files_bundle(panel_id: str, round_number: int | None = None, project_id: str | None = None) -> StreamingResponse:
+    """
+    ZIP of every file of the caller's assigned presentations, streamed as it is
+    built. Entries are stored uncompressed (PPTX/PDF are already compressed) and
+    written with data descriptors, so nothing is buffered beyond one chunk.
+    """
+    query = {"assigned_panel_ids": panel_id}
+    if round_number is not None:
+        query["round_number"] = round_number
+    if project_id:
+        query["project_id"] = project_id
+    presentations = [p async for p in db.presentations.find(query, {"project_id": 1, "round_number": 1, "file_ids": 1})]
+
+    project_oids = safe_objectid_list(list({p.get("project_id") for p in presentations if p.get("project_id")}))
+    titles = {str(pr["_id"]): pr.get("title") async for pr in db.projects.find({"_id": {"$in": project_oids}}, {"title": 1})} if project_oids else {}
+    file_oids = safe_objectid_list([fid for p in presentations for fid in p.get("file_ids", [])])
+    files = {str(f["_id"]): f async for f in db.files.find({"_id": {"$in": file_oids}}, {"data": 0})} if file_oids else {}
+
+    entries = []
+    used = set()
+    presentations.sort(key=lambda p: (p.get("round_number", 1), p.get("project_id", "")))
+    for p in presentations:
+        folder = re.sub(r'[\\/:*?"<>|]+', "_", titles.get(p.get("project_id")) or p.get("project_id") or "project").strip()
+        for fid in p.get("file_ids", []):
+            f = files.get(str(fid))
+            if not f:
+                continue
+            name = f"round_{p.get('round_number', 1)}/{folder}/{f.get('filename', 'file').replace('/', '_')}"
+            base, n = name, 1
+            while name in used:
+                n += 1
+                stem, dot, ext = base.rpartition(".")
+                name = f"{stem} ({n}).{ext}" if dot else f"{base} ({n})"
+            used.add(name)
+            entries.append((name, f))
+    if not entries:
+        raise HTTPException(status_code=404, detail="No presentation files found")
+
+    async def stream():
+        sink = _ZipSink()
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+            for name, f in entries:
+                info = zipfile.ZipInfo(name, date_time=_zip_date(f.get("uploaded_at")))
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = f.get("length") or 0  # lets zipfile pick ZIP64 up front
+                with zf.open(info, "w") as dest:
+                    async for chunk in _file_chunks(f):
+                        dest.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+        yield sink.drain()
+
+    archive = f"presentations_round_{round_number}.zip" if round_number is not None else "presentations.zip"
+    return StreamingResponse(stream(), media_type="application/zip", headers={
+        "Content-Disposition": file_service.content_disposition(archive),
+    })
+
+
+async def prefetch_round_files(round_number: int) -> int:
+    """Warm the download cache with the files of every presentation in a round"""
+    file_ids = []
+    async for p in db.presentations.find({"round_number": round_number}, {"file_ids": 1}):
+        file_ids.extend(p.get("file_ids", []))
+    oids = safe_objectid_list(file_ids)
+    if not oids:
+        return 0
+    gridfs_ids = [f["gridfs_id"] async for f in db.files.find({"_id": {"$in": oids}, "gridfs_id": {"$exists": True}}, {"gridfs_id": 1})]
+    return await file_cache_service.prefetch(gridfs_ids)
+
+
+def _migration_claimable(now: datetime) -> dict:
+    return {"$or": [
+        {"migrating": {"$exists": False}},
+        {"migrating": {"$lt": now - timedelta(minutes=MIGRATION_CLAIM_MINUTES)}},
+    ]}
+
+
+async def migrate_inline_files(batch_size: int = 20, pause_seconds: float = 0.5) -> dict:
+    """
+    Move inline `data` blobs from db.files into content-addressed GridFS storage.
+
+    New content is written to GridFS under the document's own _id; content
+    already stored is just referenced. The document then gets gridfs_id/sha256
+    and loses data. Progress is implied by which documents still have data and
+    blob references are a set, so the job can be stopped and re-run at any time.
+    Each document is claimed (migrating timestamp) first, so workers running
+    the job at the same time never handle the same document.
+    """
+    migrated = 0
+    moved_bytes = 0
+    while True:
+        query = {"data": {"$exists": True}, **_migration_claimable(datetime.utcnow())}
+        batch = [d async for d in db.files.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+        if not batch:
+            break
+        for ref in batch:
+            # Claim the document so no other worker writes (or cleans up) its GridFS entry at the same time
+            claimed_at = datetime.utcnow()
+            doc = await db.files.find_one_and_update(
+                {"_id": ref["_id"], "data": {"$exists": True}, **_migration_claimable(claimed_at)},
+                {"$set": {"migrating": claimed_at}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if not doc:
+                continue  # handled concurrently
+            data = bytes(doc.get("data") or b"")
+            digest = hashlib.sha256(data).hexdigest()
+            blob = await db.blobs.find_one({"_id": digest}, {"gridfs_id": 1})
+            if blob:
+                gridfs_id = ObjectId(blob["gridfs_id"])
+            else:
+                gridfs_id = doc["_id"]
+                if not await db["files.files"].find_one({"_id": gridfs_id}, {"_id": 1}):
+                    # Drop chunks of an upload interrupted before its files entry was written
+                    await db["files.chunks"].delete_many({"files_id": gridfs_id})
+                    await file_service.bucket.upload_from_stream_with_id(
+                        gridfs_id,
+                        doc.get("filename", "file"),
+                        data,
+                        metadata={"uploader_id": str(doc.get("uploaded_by")), "upload_date": datetime.utcnow()},
+                    )
+            stored_id = await file_service.register_blob(digest, gridfs_id, len(data), str(doc["_id"]))
+            if stored_id != gridfs_id:
+                await file_service.bucket.delete(gridfs_id)
+            result = await db.files.update_one(
+                {"_id": doc["_id"], "migrating": claimed_at},
+                {"$set": {"gridfs_id": str(stored_id), "sha256": digest, "length": len(data)}, "$unset": {"data": "", "migrating": ""}},
+            )
+            if not result.modified_count:
+                continue  # claim was taken over; the new owner finishes the document
+            migrated += 1
+            moved_bytes += len(data)
+        await asyncio.sleep(pause_seconds)  # leave room for regular traffic
+
+    if migrated:
+        print(f"Migrated {migrated} presentation files ({moved_bytes} bytes) to GridFS")
+    return {"migrated": migrated, "bytes": moved_bytes}
+
+
+# --------------------------------------------------------
+# Presentations joined with their file metadata in one aggregation.
+# file_ids holds strings, so they are converted to ObjectIds (invalid ones
+# dropped) before the $lookup; only listing fields are read, never `data`.
+# --------------------------------------------------------
+def _with_files_pipeline(match: dict, as_field: str) -> list[dict]:
+    return [
+        {"$match": match},
+        {"$sort": {"round_number": 1}},
+        {"$addFields": {"_file_oids": {"$map": {
+            "input": {"$ifNull": ["$file_ids", []]},
+            "in": {"$convert": {"input": "$$this", "to": "objectId", "onError": None, "onNull": None}},
+        }}}},
+        {"$lookup": {
+            "from": "files",
+            "localField": "_file_oids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"filename": 1, "uploaded_at": 1, "content_type": 1}}],
+            "as": as_field,
+        }},
+        {"$project": {"_file_oids": 0}},
+    ]
+
+
+def _joined_out(p: dict, as_field: str) -> dict:
+    p["id"] = str(p.pop("_id"))
+    p[as_field] = [
+        {
+            "id": str(f["_id"]),
+            "filename": f.get("filename"),
+            "uploaded_at": f.get("uploaded_at"),
+            "content_type": f.get("content_type"),
+        }
+        for f in p.get(as_field, [])
+    ]
+    return p
+
+
 # --------------------------------------------------------
 # 🧩 5️⃣ Fetch presentation + files (optional helper)
 # --------------------------------------------------------
 async def get_presentation_with_files(presentation_id: str):
-    presentation = await get_presentation_by_id(presentation_id)
-    if not presentation:
+    presentation_objectid = safe_objectid(presentation_id)
+    if not presentation_objectid:
         return None
-
-    file_ids = presentation.get("file_ids", [])
-    files = []
-    if file_ids:
-        cursor = db.files.find({"_id": {"$in": [ObjectId(fid) for fid in file_ids]}})
-        async for f in cursor:
-            f["id"] = str(f["_id"])
-            del f["_id"]
-            files.append(f)
-
-    presentation["files"] = files
-    return presentation
+    async for p in db.presentations.aggregate(_with_files_pipeline({"_id": presentation_objectid}, "files")):
+        return _joined_out(p, "files")
+    return None
 
 
 # --------------------------------------------------------
 # 🧩 6️⃣ Get presentations by project_id
 # --------------------------------------------------------
 async def get_presentations_by_project(project_id: str):
-    presentations = []
-    cursor = db.presentations.find({"project_id": project_id}).sort("round_number", 1)
-    async for p in cursor:
-        p["id"] = str(p["_id"])
-        del p["_id"]
-        # Get file details
-        file_ids = p.get("file_ids", [])
-        files = []
-        if file_ids:
-            fcur = db.files.find({"_id": {"$in": [ObjectId(fid) for fid in file_ids]}})
-            async for f in fcur:
-                files.append({
-                    "id": str(f["_id"]),
-                    "filename": f.get("filename"),
-                    "uploaded_at": f.get("uploaded_at"),
-                    "content_type": f.get("content_type")
-                })
-        p["file_list"] = files
-        presentations.append(p)
-    return presentations
+    pipeline = _with_files_pipeline({"project_id": project_id}, "file_list")
+    return [_joined_out(p, "file_list") async for p in db.presentations.aggregate(pipeline)]
 
 
 # --------------------------------------------------------
@@ -126,6 +392,11 @@ async def delete_presentation(presentation_id: str):
         # Optionally delete associated files
         file_ids = presentation.get("file_ids", [])
         if file_ids:
-            await db.files.delete_many({"_id": {"$in": [ObjectId(fid) for fid in file_ids]}})
+            await delete_files(file_ids)
         await db.presentations.delete_one({"_id": ObjectId(presentation_id)})
-    return {"deleted": True}
\ No newline at end of file
+    return {"deleted": True}
+
+
+async def ensure_indexes():
+    await db.presentations.create_index([("project_id", ASCENDING), ("round_number", ASCENDING)])
+    await db.presentations.create_index([("file_ids", ASCENDING)])
@@ -1,8 +1,11 @@
 from bson import ObjectId
 from app.config.database import db
+from app.core.permissions import invalidate_memberships
 
 async def create_project(project_data: dict):
     result = await db.projects.insert_one(project_data)
+    if project_data.get("team_id"):
+        invalidate_memberships()
     return str(result.inserted_id)
 
 async def get_project_by_id(project_id: str):
@@ -10,10 +13,13 @@ async def get_project_by_id(project_id: str):
 
 async def update_project(project_id: str, update_data: dict):
     await db.projects.update_one({"_id": ObjectId(project_id)}, {"$set": update_data})
+    if "team_id" in update_data:
+        invalidate_memberships()
     return await get_project_by_id(project_id)
 
 async def delete_project(project_id: str):
     await db.projects.delete_one({"_id": ObjectId(project_id)})
+    invalidate_memberships()
     return {"deleted": True}
 
 async def get_projects_by_user(user_id: str):
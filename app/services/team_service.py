@@ -1,8 +1,11 @@
 from bson import ObjectId
+from pymongo import ASCENDING
 from app.config.database import db
+from app.core.permissions import invalidate_memberships
 
 async def create_team(team_data: dict):
     result = await db.teams.insert_one(team_data)
+    invalidate_memberships()
     return str(result.inserted_id)
 
 async def get_teams():
@@ -25,10 +28,12 @@ async def get_team_by_id(team_id: str):
 
 async def update_team(team_id: str, update_data: dict):
     await db.teams.update_one({"_id": ObjectId(team_id)}, {"$set": update_data})
+    invalidate_memberships()
     return await get_team_by_id(team_id)
 
 async def delete_team(team_id: str):
     await db.teams.delete_one({"_id": ObjectId(team_id)})
+    invalidate_memberships()
     return {"deleted": True}
 
 async def get_teams_by_user(user_id: str):
@@ -38,3 +43,9 @@ async def get_teams_by_user(user_id: str):
     async for t in cursor:
         teams.append(t)
     return teams
+
+
+async def ensure_indexes():
+    # Membership lookups (app.core.permissions) match on either list
+    await db.teams.create_index([("members", ASCENDING)])
+    await db.teams.create_index([("member_ids", ASCENDING)])
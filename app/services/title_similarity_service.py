@@ -0,0 +1,179 @@
+import re
+import zlib
+import numpy as np
+from pymongo import ASCENDING, DeleteMany, UpdateOne
+from app.config.database import db
+
+# MinHash/LSH parameters: 64 permutations in 16 bands of 4 rows puts the
+# LSH threshold near Jaccard 0.5.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+DEFAULT_THRESHOLD = 0.5
+TITLE_FIELDS = ("title_1", "title_2", "title_3")
+
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20240601)  # fixed seed: persisted signatures must stay comparable
+_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+
+_STOPWORDS = {"a", "an", "the", "of", "for", "and", "in", "on", "to", "using", "with", "based", "system", "by"}
+
+
+def shingles(title: str) -> set[str]:
+    """Word unigrams and bigrams of a normalized title."""
+    words = [w for w in re.sub(r"[^a-z0-9 ]+", " ", (title or "").lower()).split() if w not in _STOPWORDS]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def signature(shingle_set: set[str]) -> np.ndarray:
+    if not shingle_set:
+        return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    hashes = np.array([zlib.crc32(s.encode()) & 0x7FFFFFFF for s in shingle_set], dtype=np.uint64)
+    # (a * x + b) mod p for every permutation/shingle pair, minimum per permutation
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def band_keys(sig: np.ndarray) -> list[str]:
+    return [f"{b}:{zlib.crc32(sig[b * ROWS:(b + 1) * ROWS].tobytes()):08x}" for b in range(BANDS)]
+
+
+def _owner(doc: dict) -> str:
+    # Every student row of a group repeats the group's titles, so index per
+    # group; group numbers restart in every upload, hence the batch prefix
+    if doc.get("group_no"):
+        return f"{doc.get('batch_id')}/{doc.get('sheet_name', 'CSV')}/{doc['group_no']}"
+    return str(doc["_id"])
+
+
+async def index_allocations(query: dict) -> int:
+    """(Re)compute signatures for the titles of the matching allocation rows; an empty query rebuilds the index."""
+    if not query:
+        await db.title_signatures.delete_many({})
+    projection = {"sheet_name": 1, "group_no": 1, "batch_id": 1, **{f: 1 for f in TITLE_FIELDS}}
+    docs = [d async for d in db.allocations.find(query, projection)]
+    if query:
+        # Usually only a group's first row carries its titles, so a group is
+        # always indexed from all of its rows, never from the matched ones alone
+        groups = {(d.get("batch_id"), d["group_no"]) for d in docs if d.get("group_no")}
+        if groups:
+            seen = {d["_id"] for d in docs}
+            group_query = {"$or": [{"batch_id": b, "group_no": g} for b, g in groups], "_id": {"$nin": list(seen)}}
+            owners = {_owner(d) for d in docs}
+            docs += [d async for d in db.allocations.find(group_query, projection) if _owner(d) in owners]
+    docs.sort(key=lambda d: d["_id"])
+
+    # First non-empty title per group and field, with the row it came from
+    titles: dict[tuple[str, str], tuple[str, dict]] = {}
+    for doc in docs:
+        owner = _owner(doc)
+        for field in TITLE_FIELDS:
+            title = (doc.get(field) or "").strip()
+            if (owner, field) not in titles or (title and not titles[(owner, field)][0]):
+                titles[(owner, field)] = (title, doc)
+
+    ops = []
+    for (owner, field), (title, doc) in titles.items():
+        shingle_set = shingles(title)
+        if not shingle_set:
+            ops.append(DeleteMany({"owner": owner, "field": field}))
+            continue
+        sig = signature(shingle_set)
+        ops.append(UpdateOne(
+            {"owner": owner, "field": field},
+            {"$set": {
+                "owner": owner,
+                "field": field,
+                "title": title,
+                "sheet_name": doc.get("sheet_name", "CSV"),
+                "group_no": doc.get("group_no", ""),
+                "batch_id": doc.get("batch_id"),
+                "signature": [int(v) for v in sig],
+                "bands": band_keys(sig),
+            }},
+            upsert=True,
+        ))
+    if ops:
+        await db.title_signatures.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def reindex_record(record_id, previous: dict):
+    """
+    Re-index an edited allocation row. If the edit moved it to another
+    group, the group it left is re-indexed from its remaining rows, or its
+    signatures dropped when none are left.
+    """
+    await index_allocations({"_id": record_id})
+    current = await db.allocations.find_one({"_id": record_id}, {"batch_id": 1, "sheet_name": 1, "group_no": 1})
+    old_owner = _owner(previous)
+    if current is None or _owner(current) == old_owner:
+        return
+    await db.title_signatures.delete_many({"owner": old_owner})
+    if previous.get("group_no"):
+        await index_allocations({"batch_id": previous.get("batch_id"), "group_no": previous["group_no"]})
+
+
+async def remove_batch(batch_id: str):
+    await db.title_signatures.delete_many({"batch_id": batch_id})
+
+
+async def find_near_duplicates(batch_id: str | None = None, threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """Cluster near-duplicate titles within a batch, or across all batches.
+
+    Candidate pairs come from shared LSH bands; pairs whose estimated Jaccard
+    similarity reaches threshold are joined with union-find.
+    """
+    query = {"batch_id": batch_id} if batch_id else {}
+    docs = [d async for d in db.title_signatures.find(query, {"_id": 0})]
+
+    buckets: dict[str, list[int]] = {}
+    for i, d in enumerate(docs):
+        for band in d["bands"]:
+            buckets.setdefault(band, []).append(i)
+
+    parent = list(range(len(docs)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    sigs = np.array([d["signature"] for d in docs], dtype=np.uint64) if docs else None
+    best: dict[int, float] = {}
+    checked = set()
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                i, j = members[x], members[y]
+                if (i, j) in checked or docs[i]["owner"] == docs[j]["owner"]:
+                    continue
+                checked.add((i, j))
+                similarity = float(np.mean(sigs[i] == sigs[j]))
+                if similarity >= threshold:
+                    parent[find(i)] = find(j)
+                    best[i] = max(best.get(i, 0.0), similarity)
+                    best[j] = max(best.get(j, 0.0), similarity)
+
+    clusters: dict[int, list[dict]] = {}
+    for i in best:
+        d = docs[i]
+        clusters.setdefault(find(i), []).append({
+            "title": d["title"],
+            "field": d["field"],
+            "sheet_name": d.get("sheet_name"),
+            "group_no": d.get("group_no"),
+            "batch_id": d.get("batch_id"),
+            "similarity": round(best[i], 3),
+        })
+    result = [{"size": len(m), "titles": m} for m in clusters.values()]
+    result.sort(key=lambda c: -c["size"])
+    return result
+
+
+async def ensure_indexes():
+    await db.title_signatures.create_index([("owner", ASCENDING), ("field", ASCENDING)], unique=True)
+    await db.title_signatures.create_index([("batch_id", ASCENDING)])
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import math
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi import HTTPException, Request
+from pymongo import ASCENDING, ReturnDocument
+from app.config.database import db
+from app.core.mongodb_utils import safe_objectid
+from app.services import file_service
+
+# Resumable uploads. A session reserves a GridFS id up front and every chunk
+# the client PUTs is written straight into files.chunks as chunk n of that
+# file, so chunks can arrive in any order and in parallel. Finalizing only
+# adds the files.files entry (after hashing for deduplication); the content
+# is never copied again. Sessions idle for SESSION_TTL_HOURS are expired.
+DEFAULT_CHUNK_SIZE = file_service.UPLOAD_CHUNK_SIZE
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+EXPIRY_INTERVAL_SECONDS = 15 * 60
+# A "finalizing" claim older than this is assumed to belong to a crashed worker
+FINALIZE_TIMEOUT_MINUTES = int(os.getenv("UPLOAD_FINALIZE_TIMEOUT_MINUTES", "10"))
+
+chunks = db["files.chunks"]
+
+
+def _session_out(session: dict) -> dict:
+    received = sorted(session.get("received", []))
+    return {
+        "id": str(session["_id"]),
+        "kind": session["kind"],
+        "filename": session["filename"],
+        "total_size": session["total_size"],
+        "chunk_size": session["chunk_size"],
+        "total_chunks": session["total_chunks"],
+        "received": received,
+        "missing": sorted(set(range(session["total_chunks"])) - set(received)),
+        "status": session["status"],
+        "expires_at": session["expires_at"].isoformat(),
+        "result": session.get("result"),
+    }
+
+
+async def create_session(kind: str, owner_id: str, filename: str, total_size: int, chunk_size: int | None = None,
+                         content_type: str | None = None, context: dict | None = None) -> dict:
+    """Open an upload session; `context` carries the form fields needed when finalizing"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in file_service.ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}")
+    if total_size <= 0:
+        raise HTTPException(status_code=400, detail="total_size must be positive")
+    if total_size > file_service.MAX_UPLOAD_SIZE:
+        raise file_service._too_large()
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"chunk_size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes")
+
+    now = datetime.utcnow()
+    session = {
+        "_id": ObjectId(),
+        "kind": kind,
+        "owner_id": str(owner_id),
+        "filename": filename,
+        "content_type": content_type,
+        "total_size": total_size,
+        "chunk_size": chunk_size,
+        "total_chunks": math.ceil(total_size / chunk_size),
+        "gridfs_id": ObjectId(),
+        "ref_id": ObjectId(),  # _id of the document the finished file is attached to
+        "received": [],
+        "context": context or {},
+        "status": "open",
+        "created_at": now,
+        "expires_at": now + timedelta(hours=SESSION_TTL_HOURS),
+    }
+    await db.upload_sessions.insert_one(session)
+    return _session_out(session)
+
+
+async def _get_session(session_id: str, kind: str, owner_id: str) -> dict:
+    oid = safe_objectid(session_id)
+    session = await db.upload_sessions.find_one({"_id": oid}) if oid else None
+    if not session or session["kind"] != kind:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session["owner_id"] != str(owner_id):
+        raise HTTPException(status_code=403, detail="Not authorized for this upload session")
+    return session
+
+
+async def get_session(session_id: str, kind: str, owner_id: str) -> dict:
+    return _session_out(await _get_session(session_id, kind, owner_id))
+
+
+async def read_chunk(request: Request) -> bytes:
+    """Read a chunk request body, refusing anything larger than MAX_CHUNK_SIZE"""
+    parts = []
+    size = 0
+    async for part in request.stream():
+        size += len(part)
+        if size > MAX_CHUNK_SIZE:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {MAX_CHUNK_SIZE} bytes")
+        parts.append(part)
+    return b"".join(parts)
+
+
+async def put_chunk(session_id: str, kind: str, owner_id: str, index: int, data: bytes) -> dict:
+    """Store chunk `index` as GridFS chunk n=index; re-sending a chunk overwrites it"""
+    session = await _get_session(session_id, kind, owner_id)
+    if session["status"] != "open":
+        raise HTTPException(status_code=409, detail="Upload session is already finalized")
+    total_chunks, chunk_size = session["total_chunks"], session["chunk_size"]
+    if not 0 <= index < total_chunks:
+        raise HTTPException(status_code=400, detail=f"Chunk index must be between 0 and {total_chunks - 1}")
+    expected = chunk_size if index < total_chunks - 1 else session["total_size"] - chunk_size * (total_chunks - 1)
+    if len(data) != expected:
+        raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected} bytes, got {len(data)}")
+
+    await chunks.replace_one(
+        {"files_id": session["gridfs_id"], "n": index},
+        {"files_id": session["gridfs_id"], "n": index, "data": data},
+        upsert=True,
+    )
+    session = await db.upload_sessions.find_one_and_update(
+        {"_id": session["_id"]},
+        {
+            "$addToSet": {"received": index},
+            "$set": {"expires_at": datetime.utcnow() + timedelta(hours=SESSION_TTL_HOURS)},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    return {"index": index, "received": len(session["received"]), "total_chunks": total_chunks}
+
+
+async def _assemble(session: dict) -> dict:
+    """Hash the stored chunks in order, add the files.files entry and register the blob"""
+    gridfs_id = session["gridfs_id"]
+    hasher = hashlib.sha256()
+    length = 0
+    async for chunk in chunks.find({"files_id": gridfs_id}, {"data": 1}).sort("n", ASCENDING).batch_size(4):
+        hasher.update(chunk["data"])
+        length += len(chunk["data"])
+    if length != session["total_size"]:
+        raise HTTPException(status_code=409, detail="Stored chunks do not add up to total_size")
+
+    await db["files.files"].replace_one({"_id": gridfs_id}, {
+        "_id": gridfs_id,
+        "length": length,
+        "chunkSize": session["chunk_size"],
+        "uploadDate": datetime.utcnow(),
+        "filename": session["filename"],
+        "metadata": {"uploader_id": session["owner_id"], "upload_date": datetime.utcnow()},
+    }, upsert=True)
+    digest = hasher.hexdigest()
+    stored_id = await file_service.register_blob(digest, gridfs_id, length, str(session["ref_id"]))
+    if stored_id != gridfs_id:
+        await file_service.bucket.delete(gridfs_id)
+    return {"gridfs_id": str(stored_id), "sha256": digest, "length": length}
+
+
+async def finalize(session_id: str, kind: str, owner_id: str, attach) -> dict:
+    """
+    Turn the received chunks into a GridFS file and hand the resulting blob to
+    `attach(session, blob)`, which creates the owning document (with _id
+    session["ref_id"]) and returns the response. Finalizing a completed
+    session again returns the same response, so clients can safely retry
+    after losing the reply.
+    """
+    session = await _get_session(session_id, kind, owner_id)
+    if session["status"] == "complete":
+        return session["result"]
+    missing = sorted(set(range(session["total_chunks"])) - set(session.get("received", [])))
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "missing": missing[:100]})
+    now = datetime.utcnow()
+    claimed = await db.upload_sessions.find_one_and_update(
+        {"_id": session["_id"], "$or": [
+            {"status": "open"},
+            # Claim left behind by a worker that died mid-finalize; resuming is safe
+            {"status": "finalizing", "finalizing_at": {"$not": {"$gte": now - timedelta(minutes=FINALIZE_TIMEOUT_MINUTES)}}},
+        ]},
+        {"$set": {"status": "finalizing", "finalizing_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Upload session is being finalized")
+
+    try:
+        registered = await db.blobs.find_one({"refs": str(session["ref_id"])})
+        if registered:
+            # A previous attempt got as far as registering the content
+            blob = {"gridfs_id": registered["gridfs_id"], "sha256": registered["_id"], "length": registered["length"]}
+        else:
+            blob = await _assemble(session)
+        result = await attach(session, blob)
+    except BaseException:
+        await db.upload_sessions.update_one({"_id": session["_id"]}, {"$set": {"status": "open"}})
+        raise
+
+    await db.upload_sessions.update_one(
+        {"_id": session["_id"]},
+        {"$set": {"status": "complete", "result": result}, "$unset": {"context": ""}},
+    )
+    return result
+
+
+def _stale_claim(session: dict) -> bool:
+    started = session.get("finalizing_at")
+    return session["status"] == "finalizing" and (
+        started is None or started < datetime.utcnow() - timedelta(minutes=FINALIZE_TIMEOUT_MINUTES)
+    )
+
+
+async def abort(session_id: str, kind: str, owner_id: str) -> dict:
+    session = await _get_session(session_id, kind, owner_id)
+    if session["status"] == "complete":
+        raise HTTPException(status_code=409, detail="Upload session is already finalized")
+    if session["status"] == "finalizing" and not _stale_claim(session):
+        raise HTTPException(status_code=409, detail="Upload session is being finalized")
+    deleted = await db.upload_sessions.delete_one({"_id": session["_id"], "status": session["status"]})
+    if not deleted.deleted_count:
+        raise HTTPException(status_code=409, detail="Upload session is being finalized")
+    # An interrupted finalize may already have written the files.files entry;
+    # that content is left to the file garbage collector
+    if not await db["files.files"].find_one({"_id": session["gridfs_id"]}, {"_id": 1}):
+        await chunks.delete_many({"files_id": session["gridfs_id"]})
+    return {"deleted": True}
+
+
+async def expire_sessions() -> int:
+    """Drop sessions past expires_at together with the chunks of unfinished ones"""
+    expired = 0
+    async for session in db.upload_sessions.find({"expires_at": {"$lt": datetime.utcnow()}}, {"gridfs_id": 1, "status": 1}):
+        # Chunks of a session that never got a files.files entry are unreferenced
+        if session["status"] != "complete" and not await db["files.files"].find_one({"_id": session["gridfs_id"]}, {"_id": 1}):
+            await chunks.delete_many({"files_id": session["gridfs_id"]})
+        await db.upload_sessions.delete_one({"_id": session["_id"]})
+        expired += 1
+    return expired
+
+
+async def run_expiry_loop():
+    while True:
+        try:
+            expired = await expire_sessions()
+            if expired:
+                print(f"Expired {expired} upload sessions")
+        except Exception as e:
+            print("upload session expiry error:", e)
+        await asyncio.sleep(EXPIRY_INTERVAL_SECONDS)
+
+
+async def ensure_indexes():
+    await db.upload_sessions.create_index([("expires_at", ASCENDING)])
+    await db.upload_sessions.create_index([("gridfs_id", ASCENDING)])
+    await db.upload_sessions.create_index([("ref_id", ASCENDING)])
+    # Same spec the GridFS driver creates; needed before the first driver upload
+    await chunks.create_index([("files_id", ASCENDING), ("n", ASCENDING)], unique=True)
@@ -1,12 +1,14 @@
 # app/services/user_service.py
 from app.config.database import users_collection
 from app.services.auth_service import hash_password
+from app.services import guide_match_service
 from bson import ObjectId
 
 async def create_user(user_data: dict):
     user = user_data.copy()
     user["password"] = hash_password(user["password"])
     result = await users_collection.insert_one(user)
+    guide_match_service.invalidate()
     return str(result.inserted_id)
 
 async def get_user_by_email(email: str):
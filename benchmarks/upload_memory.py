@@ -0,0 +1,71 @@
+"""
+Memory benchmark for file_service.save_file: N concurrent uploads of SIZE_MB each
+streamed into GridFS. Needs a reachable MongoDB (MONGO_URI / DB_NAME as for the app).
+
+    python -m benchmarks.upload_memory --uploads 20 --size-mb 100
+
+Reports peak Python heap (tracemalloc) and peak process RSS. With chunked
+streaming the peak should stay around uploads * UPLOAD_CHUNK_SIZE rather than
+uploads * size.
+"""
+import argparse
+import asyncio
+import resource
+import time
+import tracemalloc
+
+from bson import ObjectId
+from fastapi import UploadFile
+
+from app.config.database import db
+from app.services import file_service
+
+
+class _ZeroFile:
+    """File-like object that produces `size` bytes on demand without holding them."""
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self._rolled = True  # make UploadFile treat it like an on-disk spool
+
+    def read(self, n: int = -1) -> bytes:
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        self.remaining -= n
+        return b"\0" * n
+
+    def seek(self, *_):
+        return 0
+
+    def close(self):
+        pass
+
+
+async def main(uploads: int, size_mb: int):
+    size = size_mb * 1024 * 1024
+    files = [UploadFile(_ZeroFile(size), size=size, filename=f"bench-{i}.pdf") for i in range(uploads)]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    saved = await asyncio.gather(*[file_service.save_file(f, "benchmark") for f in files])
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"{uploads} x {size_mb} MB uploads in {elapsed:.1f}s")
+    print(f"peak Python heap: {peak / (1024 * 1024):.1f} MB")
+    print(f"peak RSS: {rss_mb:.1f} MB")
+
+    # Clean up the benchmark data
+    for doc in saved:
+        await file_service.bucket.delete(ObjectId(doc["gridfs_id"]))
+        await db.files.delete_one({"_id": ObjectId(doc["id"])})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--size-mb", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.uploads, args.size_mb))
@@ -21,8 +21,15 @@ export default function FileManager({ projectId }: FileManagerProps) {
   const fetchFiles = async () => {
     if (!projectId) return
     try {
-      const response = await api.get(`/files/project/${projectId}`)
-      setFiles(response.data || [])
+      // Follow next_cursor until the last page
+      const items: any[] = []
+      let cursor: string | null = null
+      do {
+        const r: any = await api.get(`/files/project/${projectId}`, { params: { limit: 200, cursor: cursor ?? undefined } })
+        items.push(...(r.data?.items || []))
+        cursor = r.data?.next_cursor ?? null
+      } while (cursor)
+      setFiles(items)
     } catch (error) {
       console.error('Failed to fetch files:', error)
       setFiles([])
@@ -31,6 +31,7 @@ interface NotificationPanelProps {
 export default function NotificationPanel({ isOpen, onClose, onMarkAllRead }: NotificationPanelProps) {
   const [announcements, setAnnouncements] = useState<Announcement[]>([])
   const [notifications, setNotifications] = useState<Notification[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [loading, setLoading] = useState(true)
 
   useEffect(() => {
@@ -48,7 +49,8 @@ export default function NotificationPanel({ isOpen, onClose, onMarkAllRead }: No
       ])
 
       setAnnouncements(announcementsRes.data)
-      setNotifications(notificationsRes.data)
+      setNotifications(notificationsRes.data.items)
+      setNextCursor(notificationsRes.data.next_cursor)
     } catch (error) {
       console.error('Failed to fetch notifications:', error)
     } finally {
@@ -56,6 +58,17 @@ export default function NotificationPanel({ isOpen, onClose, onMarkAllRead }: No
     }
   }
 
+  const loadMore = async () => {
+    if (!nextCursor) return
+    try {
+      const res = await api.get('/notifications/', { params: { cursor: nextCursor } })
+      setNotifications(prev => [...prev, ...res.data.items])
+      setNextCursor(res.data.next_cursor)
+    } catch (error) {
+      toast.error('Failed to load more notifications')
+    }
+  }
+
   const handleMarkAllRead = async () => {
     try {
       await api.post('/notifications/mark-all-read')
@@ -212,6 +225,17 @@ export default function NotificationPanel({ isOpen, onClose, onMarkAllRead }: No
                 </div>
               ))}
 
+              {nextCursor && (
+                <div className="p-2 text-center">
+                  <button
+                    onClick={loadMore}
+                    className="text-xs text-blue-600 hover:text-blue-800 font-medium"
+                  >
+                    Load older notifications
+                  </button>
+                </div>
+              )}
+
               {/* Announcements */}
               {announcements.map((announcement) => (
                 <div key={announcement.id} className="p-4 hover:bg-gray-50 transition-colors border-t border-gray-100 pt-4">
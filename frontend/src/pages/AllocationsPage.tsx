@@ -62,8 +62,14 @@ export default function AllocationsPage() {
         window.location.href = '/login'
         return
       }
-      const r = await api.get('/csv/records', { params: { limit: 500 }, headers: { Authorization: `Bearer ${token}` } })
-      const items: AllocationRow[] = r.data || []
+      // Follow next_cursor until the last page
+      const items: AllocationRow[] = []
+      let cursor: string | null = null
+      do {
+        const r = await api.get('/csv/records', { params: { limit: 500, cursor: cursor ?? undefined }, headers: { Authorization: `Bearer ${token}` } })
+        items.push(...(r.data?.items || []))
+        cursor = r.data?.next_cursor ?? null
+      } while (cursor)
       setRows(items)
       // Build groups by group_no; single inputs per team
       const byGroup: Record<string, AllocationGroup> = {}
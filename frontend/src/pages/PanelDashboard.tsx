@@ -24,6 +24,7 @@ interface FileItem {
   filename: string
   uploaded_at?: string
   content_type?: string
+  download_url?: string
 }
 
 interface StudentFeedbackItem {
@@ -201,7 +202,7 @@ export default function PanelDashboard() {
                             <li key={f.id} className="text-sm text-gray-700 flex items-center justify-between">
                               <span>{f.filename}</span>
                               <span className="text-gray-500">{f.uploaded_at ? format(new Date(f.uploaded_at), 'MMM dd, yyyy HH:mm') : ''}</span>
-                              <a className="text-blue-600 ml-3" href={`${api.defaults.baseURL}/presentations/public/file/${f.id}`} target="_blank" rel="noreferrer">Download</a>
+                              <a className="text-blue-600 ml-3" href={`${api.defaults.baseURL}${f.download_url}`} target="_blank" rel="noreferrer">Download</a>
                             </li>
                           ))}
                         </ul>
@@ -0,0 +1,41 @@
+from bson import ObjectId
+
+from app.services.allocation_service import _forward_fill, _group_rows
+
+
+def _row(group_no="", name="", enrollment="", guide="", title="", sheet="CSE-A", batch="b1"):
+    return {
+        "_id": ObjectId(), "batch_id": batch, "sheet_name": sheet, "group_no": group_no,
+        "student_name": name, "enrollment_no": enrollment, "guide_name": guide, "title_1": title,
+    }
+
+
+def test_merged_cells_fill_down_within_a_group():
+    # Only the first student of each group carries the merged group cells
+    rows = [
+        _row("A1", "Asha", "E1", "Dr. Rao", "Smart irrigation"),
+        _row(name="Bilal", enrollment="E2"),
+        _row(name="Chen", enrollment="E3"),
+        _row("A2", "Dev", "E4", "Dr. Iyer", "Crop yield prediction"),
+        _row(name="Esha", enrollment="E5"),
+    ]
+    groups = _group_rows(_forward_fill(rows))
+
+    assert set(groups) == {("CSE-A", "A1"), ("CSE-A", "A2")}
+    assert groups[("CSE-A", "A1")]["students"] == {"E1": "Asha", "E2": "Bilal", "E3": "Chen"}
+    assert groups[("CSE-A", "A1")]["guide_name"] == "Dr. Rao"
+    assert groups[("CSE-A", "A2")]["students"] == {"E4": "Dev", "E5": "Esha"}
+    assert groups[("CSE-A", "A2")]["title"] == "Crop yield prediction"
+
+
+def test_fill_does_not_cross_sheets_or_leave_a_group():
+    rows = [
+        _row("A1", "Asha", "E1", "Dr. Rao", "Smart irrigation"),
+        _row(name="Bilal", enrollment="E2", sheet="CSE-B"),
+        _row("A2", "Dev", "E4"),
+    ]
+    filled = _forward_fill(rows)
+
+    assert filled[1]["group_no"] == ""  # first row of its sheet, nothing to inherit
+    assert filled[2]["guide_name"] == ""  # own group, not the previous group's guide
+    assert rows[1]["group_no"] == ""  # input rows are not modified